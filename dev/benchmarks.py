@@ -0,0 +1,307 @@
+# micro-benchmarks of the simulation hot paths
+#
+#   python dev/benchmarks.py --output bench.json
+#   python dev/benchmarks.py --output new.json --compare bench.json
+#
+# every case is swept over particle counts, sensor counts and map sizes (the built-in
+# environments tiled scale x scale times) and stored as JSON so runs can be compared
+
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import game_environment
+import geometry_utils
+import kernels
+import main
+import wallmap
+from filter_bank import FilterBank
+from robot import Particle, ParticleSet
+
+ENVIRONMENTS = ('environment_1', 'environment_2')
+SENSOR_RANGE = 450
+SENSOR_APERTURE = math.radians(120)
+FILTER_BANK_SIZE = 16
+
+SWEEPS = {
+    'full': {
+        'particles': (100, 1000, 10000),
+        'sensors': (8, 20),
+        'scales': (1, 2, 4),
+    },
+    'quick': {
+        'particles': (100, 1000),
+        'sensors': (8,),
+        'scales': (1,),
+    },
+}
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def scaled_map(env_id, scale):
+    # the environment tiled scale x scale times, rebuilt through the bulk wallmap path
+    env = game_environment.Environment(env_id)
+    segments = env.wallmap.get_segments() / env.grid_size
+    cells_x, cells_y = env.width // env.grid_size, env.height // env.grid_size
+
+    tiles = [segments + (i * cells_x, j * cells_y, i * cells_x, j * cells_y)
+             for i in range(scale) for j in range(scale)]
+    return wallmap.Wallmap.from_segments(
+        np.concatenate(tiles), env.grid_size, width=env.width * scale, height=env.height * scale)
+
+
+def random_poses(wm, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(0, wm.width, count), rng.uniform(0, wm.height, count),
+            rng.uniform(0, 2 * math.pi, count))
+
+
+@benchmark
+def particle_measure(wm, particles, sensors):
+    # a single robot-style measurement against the whole map
+    xs, ys, angles = random_poses(wm, 1)
+    robot = Particle((xs[0], ys[0]), angles[0], range_=SENSOR_RANGE,
+                     aperture=SENSOR_APERTURE, num_sensors=sensors, type='robot')
+    segments = wm.get_segments()
+    return lambda: robot.measure(segments), 1
+
+
+@benchmark
+def particle_set_measure(wm, particles, sensors):
+    xs, ys, angles = random_poses(wm, particles)
+    particle_set = ParticleSet(xs, ys, angles, range_=SENSOR_RANGE,
+                               aperture=SENSOR_APERTURE, num_sensors=sensors)
+    segments = wm.get_segments()
+    return lambda: particle_set.measure(segments), particles
+
+
+@benchmark
+def particle_likelihood(wm, particles, sensors):
+    xs, ys, angles = random_poses(wm, particles)
+    particle_set = ParticleSet(xs, ys, angles, range_=SENSOR_RANGE,
+                               aperture=SENSOR_APERTURE, num_sensors=sensors)
+    particle_set.update(wm.get_segments())
+    ground_thruth = particle_set.measurements[0]
+    return lambda: particle_set.likelihood(ground_thruth), particles
+
+
+@benchmark
+def generate_particles(wm, particles, sensors):
+    config_data = main.read_config(os.path.join(os.path.dirname(__file__), '..', 'config.ini'), 'SimSettings1')
+    config_data.update(num_sensors=sensors, backend=kernels.backend)
+    game = main.Game(config_data, headless=True)
+
+    # swap in the benchmark map, the robot keeps its pose from the built-in environment
+    game.wallmap = wm
+    game.width, game.height = wm.width, wm.height
+    xs, ys, angles = random_poses(wm, particles)
+    initial = ParticleSet(xs, ys, angles, **game.particles.sensor_params())
+    robot_measure = game.robot.measure(wm.get_segments())
+
+    def run():
+        game.generate_particles(initial.select(np.arange(particles)), robot_measure, (None, None))
+    return run, particles
+
+
+@benchmark
+def filter_bank_step(wm, particles, sensors):
+    # the particles are split over FILTER_BANK_SIZE filters, one step includes a resample
+    bank = FilterBank(wm, FILTER_BANK_SIZE, max(particles // FILTER_BANK_SIZE, 10), gen_interval=1,
+                      range_=SENSOR_RANGE, aperture=SENSOR_APERTURE, num_sensors=sensors)
+    return lambda: bank.step(3, 5), bank.num_filters * bank.num_particles
+
+
+@benchmark
+def particle_has_collision(wm, particles, sensors):
+    xs, ys, _ = random_poses(wm, particles)
+    radius = Particle.ROBOT_SIZE
+
+    def run():
+        for x, y in zip(xs, ys):
+            wm.particle_has_collision((x, y), radius)
+    return run, particles
+
+
+@benchmark
+def get_surrounding_cells(wm, particles, sensors):
+    xs, ys, angles = random_poses(wm, particles)
+
+    def run():
+        for x, y, angle in zip(xs, ys, angles):
+            wm.get_surrounding_cells((x, y), mode='aperture', range_=SENSOR_RANGE,
+                                     angle=angle, aperture=SENSOR_APERTURE * 1.2)
+    return run, particles
+
+
+@benchmark
+def line_line_intersection(wm, particles, sensors):
+    xs, ys, angles = random_poses(wm, particles)
+    segments = wm.get_segments()
+    wall = (segments[0, :2], segments[0, 2:])
+
+    def run():
+        for x, y, angle in zip(xs, ys, angles):
+            geometry_utils.line_line_intersection(
+                wall, ((x, y), (x + SENSOR_RANGE * math.cos(angle), y + SENSOR_RANGE * math.sin(angle))))
+    return run, particles
+
+
+@benchmark
+def add_edge(wm, particles, sensors):
+    segments = wm.get_segments() / wm.grid_size
+
+    def run():
+        fresh = wallmap.Wallmap(wm.grid_size, width=wm.width, height=wm.height)
+        for segment in segments:
+            fresh.add_edge(wallmap.Edge(segment[:2], segment[2:]))
+        fresh.build_index()
+    return run, len(segments)
+
+
+# cases that do not depend on every swept parameter only run once per distinct value
+PARAMETERS = {
+    'particle_measure': ('sensors',),
+    'particle_set_measure': ('particles', 'sensors'),
+    'particle_likelihood': ('particles', 'sensors'),
+    'generate_particles': ('particles', 'sensors'),
+    'filter_bank_step': ('particles', 'sensors'),
+    'particle_has_collision': ('particles',),
+    'get_surrounding_cells': ('particles',),
+    'line_line_intersection': ('particles',),
+    'add_edge': (),
+}
+
+
+def time_case(run, repeats, min_time):
+    run()
+
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < repeats or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        run()
+        samples.append(time.perf_counter() - t0)
+        if len(samples) >= 100 * repeats:
+            break
+    return samples
+
+
+def run_benchmarks(sweep, names, repeats, min_time):
+    results = []
+
+    for name in names:
+        params = PARAMETERS[name]
+        seen = set()
+
+        for env_id, scale, particles, sensors in itertools.product(
+                ENVIRONMENTS, sweep['scales'], sweep['particles'], sweep['sensors']):
+            key = (env_id, scale) + tuple(v for p, v in (('particles', particles), ('sensors', sensors)) if p in params)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            wm = scaled_map(env_id, scale)
+            run, items = BENCHMARKS[name](wm, particles, sensors)
+            samples = time_case(run, repeats, min_time)
+
+            case = {
+                'benchmark': name,
+                'environment': env_id,
+                'scale': scale,
+                'edges': len(wm.edges),
+                'particles': particles if 'particles' in params else None,
+                'sensors': sensors if 'sensors' in params else None,
+                'items': items,
+                'repeats': len(samples),
+                'median': statistics.median(samples),
+                'min': min(samples),
+            }
+            case['per_item'] = case['median'] / max(items, 1)
+            results.append(case)
+
+            print(f"{name:24} {env_id} x{scale} particles={case['particles']} sensors={case['sensors']} "
+                  f"median {case['median'] * 1e3:9.3f}ms")
+
+    return results
+
+
+def case_key(case):
+    return (case['benchmark'], case['environment'], case['scale'], case['particles'], case['sensors'])
+
+
+def compare(results, baseline, threshold):
+    # flags every case whose median got slower than threshold times the baseline
+    previous = {case_key(case): case for case in baseline['results']}
+    regressions = []
+
+    for case in results:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+
+        ratio = case['median'] / old['median']
+        if ratio > threshold:
+            regressions.append((case, ratio))
+            print(f"REGRESSION {case['benchmark']} {case['environment']} x{case['scale']} "
+                  f"particles={case['particles']} sensors={case['sensors']}: {ratio:.2f}x slower")
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the simulation hot paths')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Path of the JSON results file')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='Previous JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='Slowdown ratio flagged as a regression')
+    parser.add_argument('--sweep', choices=sorted(SWEEPS), default='full',
+                        help='Parameter sweep to run')
+    parser.add_argument('--only', type=str, nargs='*', default=None, choices=sorted(BENCHMARKS),
+                        help='Run only these benchmarks')
+    parser.add_argument('--backend', choices=kernels.BACKENDS, default='numpy',
+                        help='Kernel backend used by the ray casting, collision and likelihood cases')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Minimum number of timed repetitions per case')
+    parser.add_argument('--min_time', type=float, default=0.2,
+                        help='Minimum time spent per case in seconds')
+    args = parser.parse_args()
+
+    backend = kernels.set_backend(args.backend)
+    results = run_benchmarks(SWEEPS[args.sweep], args.only or list(BENCHMARKS), args.repeats, args.min_time)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.machine(),
+                'sweep': args.sweep,
+                'backend': backend,
+                'results': results,
+            }, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,46 @@
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import game_environment
+import raycast
+from range_table import RangeTable
+
+NUM_PARTICLES = 20000
+SENSOR_RANGE = 450
+APERTURE = math.radians(120)
+NUM_SENSORS = 8
+
+
+def throughput(cast, xs, ys, angles):
+    start = time.perf_counter()
+    ranges = cast(xs, ys, angles, range_=SENSOR_RANGE, aperture=APERTURE, num_sensors=NUM_SENSORS)
+    elapsed = time.perf_counter() - start
+    return ranges, ranges.size / elapsed
+
+
+env = game_environment.Environment('environment_1')
+segments = env.wallmap.get_segments()
+
+xs = np.random.uniform(0, env.width, NUM_PARTICLES)
+ys = np.random.uniform(0, env.height, NUM_PARTICLES)
+angles = np.random.uniform(0, 2 * math.pi, NUM_PARTICLES)
+
+exact, exact_rate = throughput(
+    lambda *args, **kwargs: raycast.cast_rays(*args[:3], segments, **kwargs), xs, ys, angles)
+print(f'exact caster: {exact_rate:,.0f} rays/s')
+
+for resolution, headings in ((20, 36), (10, 72), (5, 144)):
+    for interpolation in ('nearest', 'bilinear'):
+        table = RangeTable(env.wallmap, range_=SENSOR_RANGE, resolution=resolution,
+                           num_headings=headings, interpolation=interpolation)
+        ranges, rate = throughput(table.cast_rays, xs, ys, angles)
+        error = np.abs(ranges - exact).mean()
+        print(f'table {resolution}px x {headings} headings ({interpolation}): '
+              f'build {table.build_time:.2f}s, {table.nbytes / 2**20:.1f} MiB, '
+              f'{rate:,.0f} rays/s, mean abs error {error:.1f}px')
@@ -0,0 +1,70 @@
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import game_environment
+import wallmap
+
+NUM_QUERIES = 20000
+BEAM_LENGTH = 450
+RADIUS = 10
+
+
+def long_walls_map(backend):
+    # a few walls crossing the whole map, each one lands in hundreds of cells
+    rng = np.random.default_rng(0)
+    cells = 200
+    ends = rng.uniform(0, cells, size=(60, 4))
+    ends[:30, [0, 2]] = (0, cells)
+    ends[30:, [1, 3]] = (0, cells)
+    return wallmap.Wallmap.from_segments(ends, 20, width=cells * 20, height=cells * 20, index_backend=backend)
+
+
+def clustered_map(backend):
+    # thousands of tiny edges packed into a corner of an otherwise empty map
+    rng = np.random.default_rng(0)
+    cells = 200
+    starts = rng.uniform(0, 10, size=(20000, 2))
+    segments = np.hstack((starts, starts + rng.uniform(-0.5, 0.5, size=(20000, 2))))
+    return wallmap.Wallmap.from_segments(segments, 20, width=cells * 20, height=cells * 20, index_backend=backend)
+
+
+def builtin_map(env_id):
+    return lambda backend: game_environment.Environment(env_id, index_backend=backend).wallmap
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+maps = {
+    'environment_1': builtin_map('environment_1'),
+    'environment_2': builtin_map('environment_2'),
+    'long_walls': long_walls_map,
+    'clustered': clustered_map,
+}
+
+for name, build in maps.items():
+    for backend in ('grid', 'strtree'):
+        wm = build(backend)
+        index, build_time = timed(wm.get_spatial_index)
+
+        rng = np.random.default_rng(1)
+        xs = rng.uniform(0, wm.width, NUM_QUERIES)
+        ys = rng.uniform(0, wm.height, NUM_QUERIES)
+        angles = rng.uniform(0, 2 * math.pi, NUM_QUERIES)
+        beams = np.column_stack((xs, ys, xs + BEAM_LENGTH * np.cos(angles), ys + BEAM_LENGTH * np.sin(angles)))
+
+        (hits, _), segment_time = timed(index.query_segments, beams)
+        (near, _), circle_time = timed(index.query_circles, np.column_stack((xs, ys)), RADIUS)
+
+        print(f'{name:14} {backend:8} edges {len(wm.edges):6} build {build_time * 1e3:7.1f}ms '
+              f'segments {NUM_QUERIES / segment_time:12,.0f}/s ({len(hits)} hits) '
+              f'circles {NUM_QUERIES / circle_time:12,.0f}/s ({len(near)} hits)')
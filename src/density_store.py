@@ -0,0 +1,163 @@
+# chunked on-disk store of density map snapshots
+#
+# append copies a (downsampled) snapshot into the current chunk and returns, full chunks
+# go to a writer thread as .npy files, memory-mapped when read back, or as compressed .npz;
+# snapshots are scaled to a peak of 1 so float16 keeps their precision, the scale is stored.
+# render_density.py turns a store into images offline
+
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+META_FILE = 'meta.json'
+
+
+class DensityStore:
+
+    def __init__(self, directory, *, downsample=1, dtype='float16', chunk_size=64, compress=False, pool_size=2):
+        self.directory = directory
+        self.downsample = downsample
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.compress = compress
+
+        # chunk buffers are allocated on the first append, once the snapshot shape is known
+        self.shape = None
+        self.pool_size = pool_size
+        self.free = queue.Queue()
+        self.pending = queue.Queue()
+
+        self.chunk = None
+        self.chunk_indices = []
+        self.chunk_scales = []
+        self.num_chunks = 0
+
+        self.indices = []
+        self.scales = []
+
+        self.error = None
+        self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+    def append(self, density_map, index):
+        if self.error is not None:
+            raise self.error
+
+        if self.shape is None:
+            self.shape = density_map.shape
+            for _ in range(self.pool_size):
+                self.free.put(np.empty((self.chunk_size,) + self.shape, dtype=self.dtype))
+
+        if self.chunk is None:
+            # blocks while every chunk buffer is still waiting to be written
+            self.chunk = self.free.get()
+
+        scale = float(density_map.max()) or 1.0
+        np.divide(density_map, scale, out=self.chunk[len(self.chunk_indices)], casting='unsafe')
+        self.chunk_indices.append(index)
+        self.chunk_scales.append(scale)
+
+        if len(self.chunk_indices) == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunk is None:
+            return
+
+        self.pending.put((self.num_chunks, self.chunk, self.chunk_indices, self.chunk_scales))
+        self.num_chunks += 1
+        self.chunk = None
+        self.chunk_indices = []
+        self.chunk_scales = []
+
+    def write_chunks(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            chunk_id, chunk, indices, scales = item
+            try:
+                if self.error is None:
+                    self.write_chunk(chunk_id, chunk[:len(indices)], indices, scales)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(chunk)
+
+    def write_chunk(self, chunk_id, snapshots, indices, scales):
+        name = f'chunk_{str(chunk_id).zfill(5)}'
+        if self.compress:
+            np.savez_compressed(os.path.join(self.directory, f'{name}.npz'), densities=snapshots)
+        else:
+            np.save(os.path.join(self.directory, f'{name}.npy'), snapshots)
+
+        # the metadata is rewritten with every chunk, an interrupted run keeps what was written
+        self.indices.extend(indices)
+        self.scales.extend(scales)
+        with open(os.path.join(self.directory, META_FILE), 'w') as meta_file:
+            json.dump({
+                'shape': list(self.shape),
+                'dtype': self.dtype.str,
+                'downsample': self.downsample,
+                'chunk_size': self.chunk_size,
+                'compress': self.compress,
+                'num_chunks': chunk_id + 1,
+                'indices': self.indices,
+                'scales': self.scales,
+            }, meta_file)
+
+    def close(self):
+        if self.writer is None:
+            return
+
+        self.flush()
+        self.pending.put(None)
+        self.writer.join()
+        self.writer = None
+
+        if self.error is not None:
+            raise self.error
+
+
+class DensityReader:
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as meta_file:
+            self.meta = json.load(meta_file)
+
+        self.indices = self.meta['indices']
+        self.scales = np.array(self.meta['scales'])
+        self.chunk_size = self.meta['chunk_size']
+        self.downsample = self.meta['downsample']
+
+        self.cached_chunk_id = None
+        self.cached_chunk = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def chunk(self, chunk_id):
+        if chunk_id != self.cached_chunk_id:
+            name = os.path.join(self.directory, f'chunk_{str(chunk_id).zfill(5)}')
+            if self.meta['compress']:
+                with np.load(f'{name}.npz') as chunk_file:
+                    self.cached_chunk = chunk_file['densities']
+            else:
+                self.cached_chunk = np.load(f'{name}.npy', mmap_mode='r')
+            self.cached_chunk_id = chunk_id
+        return self.cached_chunk
+
+    def __getitem__(self, i):
+        # the snapshot as a float32 normalized density, like Game.density_map returns
+        chunk_id, offset = divmod(i, self.chunk_size)
+        density_map = self.chunk(chunk_id)[offset].astype(np.float32) * self.scales[i]
+        return density_map / density_map.sum()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.indices[i], self[i]
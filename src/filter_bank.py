@@ -0,0 +1,274 @@
+import math
+import time
+
+import numpy as np
+
+import raycast
+from resampling import get_resampler
+from robot import SIGMA_MEASURE, SIGMA_MOVE, SIGMA_ROTATE, Particle
+
+
+class FilterBank:
+    # K independent localizers, each with its own robot, over one shared wallmap;
+    # every particle pose lives in a (K, N) array so motion, ray casting and
+    # resampling run once per step for all of the filters together.
+    # the generation follows Game.generate_particles with a fixed particle count.
+    # robots are always measured exactly, with robot_caster, while the particles go through
+    # caster (e.g. a range table) or are scored by likelihood_field as in Game
+
+    def __init__(self, wallmap, num_filters, num_particles, *,
+                 range_, aperture, num_sensors, caster=None, robot_caster=None, likelihood_field=None,
+                 resampler='multinomial',
+                 gen_interval=8, start_position=(200, 300), start_angle=0.0,
+                 gen_variance_max=1000, gen_variance_min=5, generation_split=0.5,
+                 max_generation_split=0.9, num_last_scores=5):
+
+        self.wallmap = wallmap
+        self.width, self.height = wallmap.width, wallmap.height
+        self.segments = wallmap.get_segments()
+        self.caster = caster
+        self.robot_caster = robot_caster
+        self.likelihood_field = likelihood_field
+        self.resampler = get_resampler(resampler)
+
+        self.num_filters = num_filters
+        self.num_particles = num_particles
+        self.range_ = range_
+        self.aperture = aperture
+        self.num_sensors = num_sensors
+        self.robot_radius = Particle.ROBOT_SIZE
+
+        self.gen_interval = gen_interval
+        self.gen_variance_min = gen_variance_min
+        self.max_generation_split = max_generation_split
+        self.num_confidents = min(num_particles, max(num_particles // 10, 10))
+
+        shape = (num_filters, num_particles)
+        self.xs = np.random.uniform(0, self.width, size=shape)
+        self.ys = np.random.uniform(0, self.height, size=shape)
+        self.angles = np.random.uniform(0, 2 * math.pi, size=shape)
+        self.measurements = np.full(shape + (num_sensors,), float(range_))
+
+        self.robot_xs = np.full(num_filters, float(start_position[0]))
+        self.robot_ys = np.full(num_filters, float(start_position[1]))
+        self.robot_angles = np.full(num_filters, float(start_angle))
+        self.robot_measurements = np.full((num_filters, num_sensors), float(range_))
+
+        self.current_variance = np.full(num_filters, float(gen_variance_max))
+        self.generation_split = np.full(num_filters, float(generation_split))
+        # nan marks the slots not filled yet, the mean runs over the scores seen so far
+        self.last_scores = np.full((num_filters, num_last_scores), np.nan)
+
+        self.pose_estimates = None
+        self.frame_count = 0
+
+    def __len__(self):
+        return self.num_filters
+
+    def sensor_params(self):
+        return {
+            'range_': self.range_,
+            'aperture': self.aperture,
+            'num_sensors': self.num_sensors
+        }
+
+    def cast_rays(self, xs, ys, angles, caster=None):
+        if caster is not None:
+            return caster.cast_rays(xs, ys, angles, **self.sensor_params())
+        return raycast.cast_rays(xs, ys, angles, self.segments, **self.sensor_params())
+
+    def measure(self, *, particles=False):
+        # with the same caster, the robots and all of the particles go through a single batched cast
+        xs, ys, angles = self.robot_xs, self.robot_ys, self.robot_angles
+        if particles and self.caster is self.robot_caster:
+            ranges = self.cast_rays(
+                np.concatenate((xs, self.xs.ravel())),
+                np.concatenate((ys, self.ys.ravel())),
+                np.concatenate((angles, self.angles.ravel())), self.robot_caster)
+        else:
+            ranges = self.cast_rays(xs, ys, angles, self.robot_caster)
+            if particles:
+                ranges = np.concatenate((
+                    ranges, self.cast_rays(self.xs.ravel(), self.ys.ravel(), self.angles.ravel(), self.caster)))
+        ranges += np.random.normal(0.0, SIGMA_MEASURE, size=ranges.shape)
+
+        self.robot_measurements = ranges[:self.num_filters]
+        if particles:
+            self.measurements = ranges[self.num_filters:].reshape(self.measurements.shape)
+        return self.robot_measurements
+
+    def move(self, speeds, rotations):
+        # speeds and rotations (degrees) hold one command per filter, or a single shared one;
+        # the particles of a filter follow the noisy motion of its robot as in Game.step
+        speeds = np.broadcast_to(np.asarray(speeds, dtype=np.float64), (self.num_filters,))
+        rotations = np.radians(np.broadcast_to(np.asarray(rotations, dtype=np.float64), (self.num_filters,)))
+
+        move_noise = np.where(speeds != 0, np.random.normal(0, SIGMA_MOVE, size=self.num_filters), 0)
+        steps = np.where(speeds != 0, speeds + move_noise, 0)
+
+        robot_next_xs = self.robot_xs + steps * np.cos(self.robot_angles)
+        robot_next_ys = self.robot_ys + steps * np.sin(self.robot_angles)
+        next_xs = self.xs + steps[:, None] * np.cos(self.angles)
+        next_ys = self.ys + steps[:, None] * np.sin(self.angles)
+
+        rotate_noise = np.where(rotations != 0, np.random.normal(0, SIGMA_ROTATE, size=self.num_filters), 0)
+        turns = np.where(rotations != 0, rotations + rotate_noise, 0)
+        self.robot_angles += turns
+        self.angles += turns[:, None]
+
+        free = ~self.wallmap.particles_have_collision(
+            np.column_stack((robot_next_xs, robot_next_ys)), self.robot_radius)
+        self.robot_xs = np.where(free, robot_next_xs, self.robot_xs)
+        self.robot_ys = np.where(free, robot_next_ys, self.robot_ys)
+        self.xs = np.where(free[:, None], next_xs, self.xs)
+        self.ys = np.where(free[:, None], next_ys, self.ys)
+
+    def likelihood(self):
+        if self.likelihood_field is not None:
+            return self.likelihood_field.batch_likelihood(
+                self.xs, self.ys, self.angles, self.robot_measurements, **self.sensor_params())
+
+        dists = np.abs(self.measurements - self.robot_measurements[:, None, :]).sum(axis=2)
+        max_dist = self.range_ * self.num_sensors
+        return (max_dist - dists) / max_dist
+
+    def estimate_poses(self, xs, ys, angles, weights):
+        weights = np.maximum(weights, 0)
+        weights = np.where(weights.sum(axis=1, keepdims=True) > 0, weights, 1)
+        weights = weights / weights.sum(axis=1, keepdims=True)
+
+        positions = np.column_stack(((xs * weights).sum(axis=1), (ys * weights).sum(axis=1)))
+        headings = np.arctan2((np.sin(angles) * weights).sum(axis=1), (np.cos(angles) * weights).sum(axis=1))
+        return positions, headings
+
+    def generate_positions(self, means, weights, variances, num_samples):
+        # direct sampling of one gaussian mixture per filter, as Game.generate_particle_positions
+        rows = np.arange(self.num_filters)[:, None]
+        components = self.resampler(weights, num_samples)
+        stddevs = np.sqrt(variances[rows, components])[..., None]
+        positions = means[rows, components] + np.random.normal(size=components.shape + (2,)) * stddevs
+
+        limits = np.array([self.width, self.height])
+        for _ in range(8):
+            outside = ((positions < 0) | (positions >= limits)).any(axis=2)
+            if not outside.any():
+                break
+            positions[outside] = means[rows, components][outside] + \
+                np.random.normal(size=(np.count_nonzero(outside), 2)) * stddevs[outside]
+
+        return np.clip(positions, 0, limits - 1)
+
+    def generate_particles(self):
+        scores = self.likelihood()
+
+        top_indices = np.argsort(-scores, axis=1, kind='stable')[:, :self.num_confidents]
+        top_weights = np.take_along_axis(scores, top_indices, axis=1)
+        top_xs = np.take_along_axis(self.xs, top_indices, axis=1)
+        top_ys = np.take_along_axis(self.ys, top_indices, axis=1)
+        top_angles = np.take_along_axis(self.angles, top_indices, axis=1)
+        top_scores_avg = top_weights.mean(axis=1)
+
+        self.pose_estimates = self.estimate_poses(top_xs, top_ys, top_angles, top_weights)
+
+        top_rotations = top_angles % (math.pi * 2)
+        weights_sum = top_weights.sum(axis=1)
+        # nan for the filters without a positive score, they keep their particles below
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rot_mean = (top_rotations * top_weights).sum(axis=1) / weights_sum
+            rot_variance = (((top_rotations - rot_mean[:, None]) ** 2) * top_weights).sum(axis=1) / weights_sum
+        rot_mean = rot_mean % (math.pi * 2)
+
+        # per filter adaptation of the mixture width and of the share of random particles
+        filled = ~np.isnan(self.last_scores)
+        mean_last_scores = np.where(
+            filled.any(axis=1), np.where(filled, self.last_scores, 0).sum(axis=1) / np.maximum(filled.sum(axis=1), 1),
+            np.nan)
+        improving = (np.round(top_scores_avg, 2) >= mean_last_scores) | (top_scores_avg > 0.90)
+
+        gen_multiplier = np.where(
+            improving, np.minimum(0.9, top_scores_avg), np.fmax(1.2, mean_last_scores / top_scores_avg))
+        gen_variance = self.current_variance * gen_multiplier * np.where(improving, 0.9, 1.0)
+        rot_variance *= gen_multiplier
+
+        gen_variance = np.maximum(self.gen_variance_min, gen_variance)
+        self.current_variance = gen_variance
+
+        self.last_scores = np.roll(self.last_scores, -1, axis=1)
+        self.last_scores[:, -1] = top_scores_avg
+
+        self.generation_split = np.minimum(self.max_generation_split, self.generation_split * gen_multiplier)
+
+        # filters without a positive score keep their particles, as in Game
+        components = top_weights > 0
+        valid = components.any(axis=1)
+        component_weights = np.where(components, top_weights, 0)
+        component_weights[~valid] = 1
+        component_variances = gen_variance[:, None] / np.where(components, top_weights, 1)
+
+        num_generated = self.num_particles - self.num_confidents
+        shape = (self.num_filters, num_generated)
+        top_positions = np.stack((top_xs, top_ys), axis=2)
+        positions = self.generate_positions(top_positions, component_weights, component_variances, num_generated)
+        angles = np.random.normal(
+            loc=rot_mean[:, None], scale=np.abs(rot_variance)[:, None], size=shape) % (math.pi * 2)
+
+        is_random = np.random.uniform(size=shape) < self.generation_split[:, None]
+        positions[is_random] = np.random.uniform((0, 0), (self.width, self.height), size=(is_random.sum(), 2))
+        angles[is_random] = np.random.uniform(0, 2 * math.pi, size=is_random.sum())
+
+        xs = np.concatenate((top_xs, positions[..., 0]), axis=1)
+        ys = np.concatenate((top_ys, positions[..., 1]), axis=1)
+        angles = np.concatenate((top_angles, angles), axis=1)
+        measurements = np.concatenate((
+            np.take_along_axis(self.measurements, top_indices[..., None], axis=1),
+            np.full(shape + (self.num_sensors,), float(self.range_))), axis=1)
+
+        self.xs = np.where(valid[:, None], xs, self.xs)
+        self.ys = np.where(valid[:, None], ys, self.ys)
+        self.angles = np.where(valid[:, None], angles, self.angles)
+        self.measurements = np.where(valid[:, None, None], measurements, self.measurements)
+
+    def step(self, speeds, rotations):
+        self.move(speeds, rotations)
+
+        # particles are only measured on the steps that resample them, as in Game.step,
+        # and never with the likelihood field, which scores the robot scans directly
+        resample = self.frame_count % self.gen_interval == 0
+        robot_measurements = self.measure(particles=resample and self.likelihood_field is None)
+        if resample:
+            self.generate_particles()
+
+        self.frame_count += 1
+        return robot_measurements
+
+    def localization_errors(self):
+        if self.pose_estimates is None:
+            self.pose_estimates = self.estimate_poses(
+                self.xs, self.ys, self.angles, np.ones_like(self.xs))
+
+        positions, headings = self.pose_estimates
+        position_errors = np.hypot(positions[:, 0] - self.robot_xs, positions[:, 1] - self.robot_ys)
+        heading_errors = np.abs((headings - self.robot_angles + math.pi) % (2 * math.pi) - math.pi)
+        return position_errors, heading_errors
+
+    def run(self, commands, *, steps=None):
+        # the same scripted commands drive every robot, steps repeats them cyclically
+        steps = len(commands) if steps is None else steps
+
+        start = time.perf_counter()
+        for i in range(steps):
+            speed, rotation = commands[i % len(commands)]
+            self.step(speed, rotation)
+        elapsed = time.perf_counter() - start
+
+        position_errors, heading_errors = self.localization_errors()
+
+        return {
+            'filters': self.num_filters,
+            'particles': self.num_particles,
+            'steps': steps,
+            'seconds': elapsed,
+            'steps_per_second': steps / elapsed if elapsed > 0 else float('inf'),
+            'position_errors': position_errors,
+            'heading_errors': np.degrees(heading_errors),
+        }
@@ -0,0 +1,135 @@
+# runs the filter on a worker thread, decoupled from the render loop
+#
+# the worker steps the game with the latest controls, at its own rate or as fast as it can,
+# and writes the robot and particle poses into the back one of two pose buffers before
+# swapping them; the render loop only ever draws the front buffer, so a resample never
+# holds up a frame. the worker waits for the reader before reusing a buffer it still draws
+
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+
+class Poses:
+    # the poses drawn in a frame, particles have the xs, ys, angles and radius of a ParticleSet
+
+    def __init__(self, capacity, num_sensors, radius):
+        self.radius = radius
+        self.count = 0
+        self.step = -1
+
+        self.buffer = np.empty((3, capacity), dtype=np.float64)
+
+        self.robot_position = (0.0, 0.0)
+        self.robot_angle = 0.0
+        self.robot_radius = 0
+        self.sensor_points = np.empty((num_sensors, 2), dtype=np.float64)
+
+    @property
+    def xs(self):
+        return self.buffer[0, :self.count]
+
+    @property
+    def ys(self):
+        return self.buffer[1, :self.count]
+
+    @property
+    def angles(self):
+        return self.buffer[2, :self.count]
+
+    def __len__(self):
+        return self.count
+
+    def write(self, robot, particles, step):
+        count = len(particles)
+        if count > self.buffer.shape[1]:
+            # with KLD sampling the particle count changes, the buffer only grows
+            self.buffer = np.empty((3, max(count, 2 * self.buffer.shape[1])), dtype=np.float64)
+
+        self.buffer[0, :count] = particles.xs
+        self.buffer[1, :count] = particles.ys
+        self.buffer[2, :count] = particles.angles
+        self.count = count
+        self.step = step
+
+        self.robot_position = tuple(robot.get_position())
+        self.robot_angle = robot.get_angle()
+        self.robot_radius = robot.get_radius()
+        self.sensor_points[:] = tuple(robot.compute_sensor_points(robot.measurements))
+
+
+class PoseBuffer:
+
+    def __init__(self, capacity, num_sensors, radius):
+        self.buffers = [Poses(capacity, num_sensors, radius) for _ in range(2)]
+        self.front = 0
+        self.reading = None
+        self.condition = threading.Condition()
+
+    def publish(self, robot, particles, step):
+        back = 1 - self.front
+        with self.condition:
+            while self.reading == back:
+                self.condition.wait()
+
+        # only publish swaps the buffers, the reader cannot pick up the back one meanwhile
+        self.buffers[back].write(robot, particles, step)
+        with self.condition:
+            self.front = back
+
+    @contextlib.contextmanager
+    def read(self):
+        with self.condition:
+            self.reading = self.front
+        try:
+            yield self.buffers[self.reading]
+        finally:
+            with self.condition:
+                self.reading = None
+                self.condition.notify()
+
+
+class FilterThread:
+
+    def __init__(self, game, *, rate=0):
+        # rate is in steps per second, 0 steps as fast as possible
+        self.game = game
+        self.period = 1.0 / rate if rate else 0.0
+        self.controls = (0, 0)
+
+        self.poses = PoseBuffer(len(game.particles), game.num_sensors, game.particles.radius)
+        self.poses.publish(game.robot, game.particles, game.frame_count)
+
+        self.error = None
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def set_controls(self, speed, rotation):
+        self.controls = (speed, rotation)
+
+    def run(self):
+        next_step = time.perf_counter()
+        while not self.stopping.is_set():
+            speed, rotation = self.controls
+            try:
+                self.game.step(speed, rotation)
+            except Exception as e:
+                self.error = e
+                return
+            self.poses.publish(self.game.robot, self.game.particles, self.game.frame_count)
+
+            if self.period:
+                # a late step starts the next one right away, without catching up on the missed ones
+                next_step = max(next_step + self.period, time.perf_counter())
+                self.stopping.wait(next_step - time.perf_counter())
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -1,5 +1,6 @@
 import math
 
+import numpy as np
 from shapely.geometry import LineString
 
 
@@ -37,6 +38,31 @@ def circle_line_collision(l1, l2, cpt, r):
     return xpt
 
 
+def circle_segments_collision(segments, centers, r):
+    # vectorized circle_line_collision, true for every (segment, center) row with a crossing
+    x1 = segments[:, 0] - centers[:, 0]
+    y1 = segments[:, 1] - centers[:, 1]
+    x2 = segments[:, 2] - centers[:, 0]
+    y2 = segments[:, 3] - centers[:, 1]
+    dx = x2 - x1
+    dy = y2 - y1
+    dr = np.sqrt(dx*dx + dy*dy)
+    D = x1 * y2 - x2 * y1
+    discriminant = r*r*dr*dr - D*D
+
+    root = np.sqrt(np.maximum(discriminant, 0))
+    sign_dy = np.where(dy < 0, -1, 1)
+
+    collision = np.zeros(len(segments), dtype=bool)
+    for side in (1, -1):
+        xa = (D * dy + side * sign_dy * dx * root) / (dr * dr)
+        ya = (-D * dx + side * np.abs(dy) * root) / (dr * dr)
+        ta = (xa-x1)*dx/dr + (ya-y1)*dy/dr
+        collision |= (0 < ta) & (ta < dr)
+
+    return collision & (discriminant >= 0)
+
+
 def line_line_intersection(line1, line2):
     line1 = LineString(line1)
     line2 = LineString(line2)
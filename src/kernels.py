@@ -0,0 +1,129 @@
+# optional compiled kernels for ray casting, collision and likelihood
+#
+# the numba backend compiles the hot loops in nopython mode with parallel loops,
+# while the numpy backend keeps the vectorized pure-python implementations;
+# call sites go through raycast, wallmap and robot and never pick a backend themselves
+
+import math
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('numpy', 'numba')
+
+backend = 'numpy'
+
+
+def set_backend(name):
+    global backend
+
+    if name not in BACKENDS:
+        raise ValueError(f'Invalid kernel backend {name}')
+
+    if name == 'numba' and numba is None:
+        warnings.warn('numba is not installed, falling back to the numpy kernels')
+        name = 'numpy'
+
+    backend = name
+    return backend
+
+
+def use_numba():
+    return backend == 'numba'
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _cast_beams(xs, ys, beams, segments, range_):
+        num_origins, num_beams = beams.shape
+        ranges = np.empty((num_origins, num_beams))
+
+        for i in numba.prange(num_origins):
+            for j in range(num_beams):
+                dx = math.cos(beams[i, j])
+                dy = math.sin(beams[i, j])
+                nearest = range_
+
+                for k in range(segments.shape[0]):
+                    ax = segments[k, 0] - xs[i]
+                    ay = segments[k, 1] - ys[i]
+                    ex = segments[k, 2] - segments[k, 0]
+                    ey = segments[k, 3] - segments[k, 1]
+
+                    denom = dx * ey - dy * ex
+                    if denom == 0:
+                        continue
+
+                    t = (ax * ey - ay * ex) / denom
+                    u = (ax * dy - ay * dx) / denom
+                    if 0 <= t < nearest and 0 <= u <= 1:
+                        nearest = t
+
+                ranges[i, j] = nearest
+
+        return ranges
+
+    @numba.njit(cache=True)
+    def _circle_collision(segments, cx, cy, r):
+        # same test as geometry_utils.circle_line_collision, true when any segment crosses the circle
+        for k in range(segments.shape[0]):
+            x1 = segments[k, 0] - cx
+            y1 = segments[k, 1] - cy
+            x2 = segments[k, 2] - cx
+            y2 = segments[k, 3] - cy
+            dx = x2 - x1
+            dy = y2 - y1
+            dr = math.sqrt(dx * dx + dy * dy)
+            D = x1 * y2 - x2 * y1
+            discriminant = r * r * dr * dr - D * D
+
+            if discriminant < 0:
+                continue
+
+            sign_dy = -1.0 if dy < 0 else 1.0
+            root = math.sqrt(discriminant)
+            for side in (1.0, -1.0):
+                xa = (D * dy + side * sign_dy * dx * root) / (dr * dr)
+                ya = (-D * dx + side * abs(dy) * root) / (dr * dr)
+                ta = (xa - x1) * dx / dr + (ya - y1) * dy / dr
+                if 0 < ta < dr:
+                    return True
+
+        return False
+
+    @numba.njit(parallel=True, cache=True)
+    def _likelihood(measurements, ground_thruth, max_dist):
+        scores = np.empty(measurements.shape[0])
+
+        for i in numba.prange(measurements.shape[0]):
+            dists = 0.0
+            for j in range(measurements.shape[1]):
+                dists += abs(measurements[i, j] - ground_thruth[j])
+            scores[i] = (max_dist - dists) / max_dist
+
+        return scores
+
+
+def cast_beams(xs, ys, beams, segments, range_):
+    return _cast_beams(
+        np.ascontiguousarray(xs, dtype=np.float64), np.ascontiguousarray(ys, dtype=np.float64),
+        np.ascontiguousarray(beams, dtype=np.float64), np.ascontiguousarray(segments, dtype=np.float64),
+        float(range_)
+    )
+
+
+def circle_collision(segments, position, radius):
+    return _circle_collision(
+        np.ascontiguousarray(segments, dtype=np.float64), float(position[0]), float(position[1]), float(radius))
+
+
+def likelihood(measurements, ground_thruth, max_dist):
+    return _likelihood(
+        np.ascontiguousarray(measurements, dtype=np.float64),
+        np.ascontiguousarray(ground_thruth, dtype=np.float64), float(max_dist))
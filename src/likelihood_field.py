@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+
+import raycast
+from robot import SIGMA_MEASURE
+
+
+class LikelihoodField:
+    # end-point sensor model: scan endpoints are projected from each particle pose
+    # and scored against a precomputed distance grid to the closest wall
+
+    def __init__(self, wallmap, *, resolution=5, sigma=10.0, max_distance=None):
+        self.resolution = resolution
+        self.sigma = sigma
+        self.nx = math.ceil(wallmap.width / resolution)
+        self.ny = math.ceil(wallmap.height / resolution)
+        self.max_distance = 3 * sigma if max_distance is None else max_distance
+
+        self.grid = wallmap.cached(
+            f'distance_grid_{resolution}', lambda: self.distance_transform(wallmap.get_segments()))
+
+    def distance_transform(self, segments):
+        cx, cy = np.meshgrid(
+            (np.arange(self.nx) + 0.5) * self.resolution,
+            (np.arange(self.ny) + 0.5) * self.resolution
+        )
+        cx, cy = cx.ravel(), cy.ravel()
+
+        distances = np.full(cx.size, np.inf)
+        if len(segments) == 0:
+            return distances.reshape(self.ny, self.nx)
+
+        ax, ay = segments[:, 0], segments[:, 1]
+        ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+        length_sq = np.maximum(ex * ex + ey * ey, 1e-12)
+
+        batch = max(1, raycast.MAX_BATCH_PAIRS // len(segments))
+        for start in range(0, cx.size, batch):
+            px = cx[start:start + batch, None] - ax
+            py = cy[start:start + batch, None] - ay
+            u = np.clip((px * ex + py * ey) / length_sq, 0.0, 1.0)
+            dx = px - u * ex
+            dy = py - u * ey
+            distances[start:start + batch] = np.sqrt((dx * dx + dy * dy).min(axis=1))
+
+        return distances.reshape(self.ny, self.nx)
+
+    def distance(self, xs, ys):
+        ix = np.floor(xs / self.resolution).astype(np.intp)
+        iy = np.floor(ys / self.resolution).astype(np.intp)
+        inside = (ix >= 0) & (ix < self.nx) & (iy >= 0) & (iy < self.ny)
+
+        distances = np.full(ix.shape, float(self.max_distance))
+        distances[inside] = np.minimum(self.grid[iy[inside], ix[inside]], self.max_distance)
+        return distances
+
+    def likelihood(self, particles, ground_thruth):
+        scan = np.asarray(ground_thruth, dtype=np.float64)
+
+        # beams at max range did not hit anything and carry no endpoint
+        hits = scan < particles.range_ - 3 * SIGMA_MEASURE
+        if not hits.any():
+            return np.ones(len(particles))
+
+        beams = raycast.sensor_angles(
+            particles.angles, particles.aperture, particles.num_sensors)[:, hits]
+        xs = particles.xs[:, None] + scan[hits] * np.cos(beams)
+        ys = particles.ys[:, None] + scan[hits] * np.sin(beams)
+
+        distances = self.distance(xs, ys)
+        return np.exp(-distances**2 / (2 * self.sigma**2)).mean(axis=1)
+
+    def batch_likelihood(self, xs, ys, angles, scans, *, range_, aperture, num_sensors):
+        # likelihood of (K, N) particle poses, every row scored against its own (K, S) scan
+        scans = np.asarray(scans, dtype=np.float64)
+        hits = scans < range_ - 3 * SIGMA_MEASURE
+
+        beams = raycast.sensor_angles(np.ravel(angles), aperture, num_sensors).reshape(np.shape(angles) + (num_sensors,))
+        distances = self.distance(
+            xs[..., None] + scans[:, None, :] * np.cos(beams),
+            ys[..., None] + scans[:, None, :] * np.sin(beams))
+
+        scores = np.exp(-distances**2 / (2 * self.sigma**2)) * hits[:, None, :]
+        num_hits = hits.sum(axis=1)[:, None]
+        return np.where(num_hits > 0, scores.sum(axis=2) / np.maximum(num_hits, 1), 1.0)
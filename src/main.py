@@ -1,11 +1,12 @@
 # main.py
 import argparse
+import atexit
 import configparser
 import math
 import random
 import signal
 import sys
-from itertools import chain
+import time
 from datetime import datetime
 import os
 import matplotlib.pyplot as plt
@@ -14,8 +15,21 @@ import numpy as np
 import pygame
 
 import game_environment as game_environment
+import kernels
 from consts import *
-from robot import Particle
+from filter_bank import FilterBank
+from filter_thread import FilterThread
+from density_store import DensityStore
+from likelihood_field import LikelihoodField
+from profiling import profiler
+from parallel import ParallelCaster
+from raycast import GridMarcher, IndexCaster
+from range_table import RangeTable
+from recorder import FrameRecorder
+from resampling import KLDSampler, get_resampler
+from telemetry import Telemetry
+from trajectory import load_trajectory
+from robot import Particle, ParticleSet
 from settings import *
 
 FPS = 24
@@ -26,19 +40,54 @@ GEN_VARIANCE = 1000
 
 GEN_INTERVAL = 8
 
+# one row per step, the resampling columns stay unset (nan, or -1) on the steps without one
+STATS_COLUMNS = {
+    'step': 'i8',
+    'resampling': 'i8',
+    'particles': 'i4',
+    'position_error': 'f8',
+    'heading_error': 'f8',
+    'step_seconds': 'f8',
+    'resample_seconds': 'f8',
+    'generation_variance': 'f8',
+    'generation_split': 'f8',
+    'generation_multiplier': 'f8',
+    'rotation_variance': 'f8',
+    'top_scores_avg': 'f8',
+    'mean_last_scores': 'f8',
+    'num_generated_particles': 'i4',
+    # only with --profile_memory, bytes traced by tracemalloc above the start of the phase
+    'step_memory_peak': 'i8',
+    'step_memory_net': 'i8',
+    'resample_memory_peak': 'i8',
+    'resample_memory_net': 'i8',
+    # only with --profile_memory, counted after each resampling
+    'particle_objects': 'i8',
+    'particle_sets': 'i8',
+    'numpy_blocks': 'i8',
+    'numpy_bytes': 'i8',
+    'rss_max': 'i8',
+}
+
 save_data = False
 show_data = False
 
 save_density = False
 show_density = False
 
-stats_file = None
+save_frames = False
+record_format = 'png'
+
+telemetry = None
 record_directory = None
 density_directory = None
+density_store = None
 
 class Game:
 
-    def __init__(self, config_data):
+    def __init__(self, config_data, *, headless=False):
+
+        self.headless = headless
 
         self.enviroment_id = config_data['environment_id']
         self.sensor_range = config_data['sensor_range']
@@ -49,29 +98,90 @@ class Game:
 
         self.wall_density_viz = config_data['wall_density_viz']
         self.cell_range_viz = config_data['cell_range_viz']
+        self.particle_heatmap_threshold = config_data['particle_heatmap_threshold']
+        self.threaded_filter = config_data['threaded_filter']
+        self.filter_rate = config_data['filter_rate']
 
         Particle.ROBOT_SIZE = config_data['robot_size']
         Particle.PARTICLE_SIZE = config_data['particle_size']
 
-        self.enviroment = game_environment.Environment(self.enviroment_id)
+        self.enviroment = game_environment.Environment(
+            self.enviroment_id, index_backend=config_data['index_backend'],
+            cache_directory=config_data['map_cache'] or None)
         self.wallmap = self.enviroment.wallmap
         self.width, self.height = self.enviroment.width, self.enviroment.height
         self.grid_size = self.enviroment.grid_size
 
-        pygame.init()
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption("Montecarlo Localization")
-        self.clock = pygame.time.Clock()
-
-    
-        self.particles = [
-            Particle(
-                (random.uniform(0, self.width), random.uniform(0, self.height)),
-                random.uniform(0, 2 * math.pi),
-                range_=self.sensor_range, aperture=self.sensor_aperture, num_sensors=self.num_sensors,
-                type='particle'
-            ) for _ in range(SAMPLES)
-        ]
+        kernels.set_backend(config_data['backend'])
+        self.resampler_name = config_data['resampler']
+        self.resampler = get_resampler(self.resampler_name)
+
+        self.kld_sampler = None
+        if config_data['kld']:
+            self.kld_sampler = KLDSampler(
+                epsilon=config_data['kld_epsilon'],
+                z=config_data['kld_z'],
+                bin_size=config_data['kld_bin_size'],
+                bin_angle=config_data['kld_bin_angle'],
+                min_particles=config_data['kld_min_particles'],
+                max_particles=config_data['kld_max_particles']
+            )
+
+        self.sensor_model = config_data['sensor_model']
+        if self.sensor_model not in ('beam', 'likelihood_field'):
+            raise ValueError(f'Invalid sensor model {self.sensor_model}')
+
+        self.likelihood_field = None
+        if self.sensor_model == 'likelihood_field':
+            self.likelihood_field = LikelihoodField(
+                self.wallmap,
+                resolution=config_data['likelihood_field_resolution'],
+                sigma=config_data['likelihood_field_sigma']
+            )
+
+        self.ray_caster = config_data['ray_caster']
+        ray_casters = {'brute': lambda wallmap: None, 'dda': GridMarcher, 'index': IndexCaster}
+        if self.ray_caster not in ray_casters:
+            raise ValueError(f'Invalid ray caster {self.ray_caster}')
+
+        # exact caster shared by the robot and, unless a range table is used, the particles
+        self.robot_caster = ray_casters[self.ray_caster](self.wallmap)
+        self.particle_caster = self.robot_caster
+
+        if config_data['parallel_workers'] and self.sensor_model == 'beam' and not config_data['range_table']:
+            self.particle_caster = ParallelCaster(
+                self.wallmap,
+                workers=config_data['parallel_workers'],
+                threshold=config_data['parallel_threshold'],
+                ray_caster=self.ray_caster
+            )
+
+        if config_data['range_table'] and self.sensor_model == 'beam':
+            self.particle_caster = RangeTable(
+                self.wallmap, range_=self.sensor_range,
+                resolution=config_data['range_table_resolution'],
+                num_headings=config_data['range_table_headings'],
+                interpolation=config_data['range_table_interpolation'],
+                dtype=config_data['range_table_dtype']
+            )
+
+        self.screen = None
+        self.clock = None
+
+        if not self.headless:
+            pygame.init()
+            self.screen = pygame.display.set_mode((self.width, self.height))
+            pygame.display.set_caption("Montecarlo Localization")
+            self.clock = pygame.time.Clock()
+
+        self.samples = config_data['samples']
+        self.gen_interval = config_data['gen_interval']
+        self.frame_count = 0
+
+        self.particles = ParticleSet.uniform(
+            self.samples, self.width, self.height,
+            range_=self.sensor_range, aperture=self.sensor_aperture, num_sensors=self.num_sensors
+        )
 
         self.robot_start_positions = [
             (self.width / 2.0, self.height / 2.0),
@@ -100,28 +210,42 @@ class Game:
         self.last_position_variance = 1000
 
         self.resampling_count = 0
-        
-    def get_surrounding_cells_edges(self, particle):
-        surrounding_cells = self.wallmap.get_surrounding_cells(
-            particle.get_position(),
-            mode='aperture',
-            range_=particle.range_,
-            angle=particle.get_angle(),
-            aperture=particle.aperture*1.2
-        )
-        surrounding_edges = [cell for _, cell in surrounding_cells]
-        surrounding_edges = set(chain(*surrounding_edges))
 
-        return surrounding_cells, surrounding_edges
-
-    def gaussian_distribution(self, x, y, mean, variance):
-        return np.exp(-((x - mean[0])**2 + (y - mean[1])**2) / (2 * variance)) / (2 * np.pi * variance)
-    
-    def generate_particle_positions(self, positions, weights, num_particles):
-        particle_indices = np.random.choice(
-            len(positions), size=num_particles, p=weights/np.sum(weights))
-        particles = positions[particle_indices]
-        return particles
+        self.pose_estimate = None
+        self.resample_stats = {}
+
+    def density_map(self, means, weights, variances, *, step=1):
+        # the isotropic gaussians are separable, the mixture is a single (H x C) @ (C x W) product;
+        # step samples every step-th pixel for downsampled snapshots
+        means = np.asarray(means, dtype=np.float64).reshape(-1, 2)
+        variances = np.asarray(variances, dtype=np.float64)[:, None]
+        x = np.arange(0, self.width, step)
+        y = np.arange(0, self.height, step)
+
+        gx = np.exp(-(x - means[:, :1]) ** 2 / (2 * variances))
+        gy = np.exp(-(y - means[:, 1:]) ** 2 / (2 * variances))
+        density_map = (gy * (np.asarray(weights)[:, None] / (2 * np.pi * variances))).T @ gx
+
+        return density_map / np.sum(density_map)
+
+    def generate_particle_positions(self, means, weights, variances, num_particles):
+        # draw the mixture component of every particle by weight, then sample it directly
+        components = self.resampler(weights, num_particles)
+        stddevs = np.sqrt(variances[components])[:, None]
+        positions = means[components] + np.random.normal(size=(num_particles, 2)) * stddevs
+
+        # the mixture is restricted to the frame, redraw samples that fall outside of it
+        for _ in range(8):
+            outside = (positions[:, 0] < 0) | (positions[:, 0] >= self.width) | \
+                (positions[:, 1] < 0) | (positions[:, 1] >= self.height)
+            if not outside.any():
+                break
+            positions[outside] = means[components[outside]] + \
+                np.random.normal(size=(np.count_nonzero(outside), 2)) * stddevs[outside]
+
+        positions[:, 0] = np.clip(positions[:, 0], 0, self.width - 1)
+        positions[:, 1] = np.clip(positions[:, 1], 0, self.height - 1)
+        return positions
     
     def fit_normal(self, values, weights):
             
@@ -146,44 +270,45 @@ class Game:
         self.resampling_count += 1
 
         MIN_PARTICLES = 15
-            
-        width, height = self.width, self.height
-
-        for p in particles:
-            _, p_surrounding_edges = self.get_surrounding_cells_edges(p)
-            p.update(p_surrounding_edges, grid_size=self.grid_size)
 
         number_of_confidents = max(len(particles)//10, 10)
 
-        scores = [(i, p.likelihood(ground_thruth))
-                for i, p in enumerate(particles)]
+        if self.sensor_model == 'likelihood_field':
+            with profiler.phase('resample.score'):
+                scores = self.likelihood_field.likelihood(particles, ground_thruth)
+        else:
+            with profiler.phase('resample.measure'):
+                particles.update(self.wallmap.get_segments(), caster=self.particle_caster)
+            with profiler.phase('resample.score'):
+                scores = particles.likelihood(ground_thruth)
 
-        scores.sort(key=lambda x: x[1], reverse=True)
-        top_scores = scores[:number_of_confidents]
+        with profiler.phase('resample.sort'):
+            top_indices = np.argsort(-scores, kind='stable')[:number_of_confidents]
+        top_weights = scores[top_indices]
 
-        x, y = np.meshgrid(np.arange(width), np.arange(height))
-        density_map = np.zeros((height, width))
+        top_scores_avg = np.mean(top_weights)
 
-        top_scores_avg = np.mean([score for _, score in top_scores])
+        self.pose_estimate = self.estimate_pose(particles.select(top_indices), top_weights)
 
-        top_rotations = [particles[i].get_angle()% (math.pi*2) for i, _ in top_scores]
-        (rot_mean, rot_variance) = self.fit_normal(top_rotations, [score for _, score in top_scores])
+        top_rotations = particles.get_angles()[top_indices] % (math.pi*2)
+        (rot_mean, rot_variance) = self.fit_normal(top_rotations, top_weights)
         rot_mean = rot_mean % (math.pi*2)
 
-        num_generated_particles = (len(particles) - len(top_scores))
+        num_generated_particles = (len(particles) - len(top_indices))
 
         gen_variance = self.current_variance
 
         gen_multiplier = 1
 
         # print(f"Last score {self.last_scores} ; Top score {top_scores_avg}")
-        if round(top_scores_avg,2) >= np.mean(self.last_scores) or top_scores_avg > 0.90:
+        previous_scores_avg = np.mean(self.last_scores) if self.last_scores else math.nan
+        if round(top_scores_avg,2) >= previous_scores_avg or top_scores_avg > 0.90:
             gen_multiplier = min(0.9, top_scores_avg)
             # print(f"Gen multiplier {gen_multiplier}")
             gen_variance = self.current_variance * gen_multiplier * 0.9
             rot_variance *= gen_multiplier
         else:
-            gen_multiplier = max(1.2, np.mean(self.last_scores)/top_scores_avg)
+            gen_multiplier = max(1.2, previous_scores_avg/top_scores_avg)
             # print(f"Gen multiplier {gen_multiplier}")
             gen_variance = self.current_variance * gen_multiplier
             rot_variance *= gen_multiplier
@@ -194,6 +319,7 @@ class Game:
         if len(self.last_scores) >= 5:
             self.last_scores = self.last_scores[1:]
         self.last_scores.append(top_scores_avg)
+        mean_last_scores = np.mean(self.last_scores)
 
         self.generation_split = self.generation_split * gen_multiplier # goes down with better scores
         self.generation_split = min(self.max_generation_split, self.generation_split)
@@ -203,51 +329,88 @@ class Game:
             if deductive <= 0:
                 deductive = 1
             num_generated_particles = round(deductive)
-            num_generated_particles = min(SAMPLES, num_generated_particles)
+            num_generated_particles = min(self.samples, num_generated_particles)
             num_generated_particles = max(MIN_PARTICLES, num_generated_particles)
             # print(f"Num generated particles {num_generated_particles}")
         else:
             num_generated_particles = MIN_PARTICLES
 
-        for i, weight in top_scores:
-            density_map += weight * \
-                self.gaussian_distribution(
-                    x, y, particles[i].get_position(), gen_variance * (1/weight))
+        # one gaussian component per top particle, wider for the less likely ones
+        components = top_weights > 0
+        top_positions = particles.get_positions()[top_indices][components]
+        component_weights = top_weights[components]
+        component_variances = gen_variance / component_weights
 
-        density_map /= np.sum(density_map)
-        
+        with profiler.phase('resample.generate'):
+            if components.any() and self.kld_sampler is not None:
 
-        if not np.isnan(density_map).any():
+                def draw(num_particles):
+                    # the same split between random and mixture particles, decided per particle
+                    is_random = np.random.uniform(size=num_particles) < self.generation_split
+                    num_random = np.count_nonzero(is_random)
 
-            num_random_particles = round(num_generated_particles * self.generation_split)
-            num_particles_from_gmm = num_generated_particles - num_random_particles
+                    positions = np.empty((num_particles, 2))
+                    angles = np.empty(num_particles)
+                    positions[is_random, 0] = np.random.uniform(0, self.width, size=num_random)
+                    positions[is_random, 1] = np.random.uniform(0, self.height, size=num_random)
+                    angles[is_random] = np.random.uniform(0, 2 * math.pi, size=num_random)
+                    positions[~is_random] = self.generate_particle_positions(
+                        top_positions, component_weights, component_variances, num_particles - num_random)
+                    angles[~is_random] = np.random.normal(
+                        loc=rot_mean, scale=rot_variance, size=num_particles - num_random) % (math.pi*2)
 
-            # print(f"Num random particles {num_random_particles} ; Num gmm particles {num_particles_from_gmm}")
+                    return positions, angles
 
-            generated_particle_positions_gmm = self.generate_particle_positions(np.array(
-                [x.flatten(), y.flatten()]).T, density_map.flatten(), num_particles_from_gmm)   
-            
-            generated_particle_positions_random = np.array(
-                [[random.uniform(0, self.width), random.uniform(0, self.height)] for _ in range(num_random_particles)])
-            
-            new_particles = [particles[i] for i, _ in top_scores]
+                kept_particles = particles.select(top_indices)
+                positions, angles = self.kld_sampler.sample(
+                    draw, kept_particles.get_positions(), kept_particles.get_angles())
+                num_generated_particles = len(positions)
+
+                with profiler.phase('resample.construct'):
+                    new_particles = ParticleSet.concatenate([
+                        kept_particles, ParticleSet.from_poses(positions, angles, **particles.sensor_params())])
 
-            if len(generated_particle_positions_gmm) > 0:
+            elif components.any():
 
-                new_particles.extend([Particle(position, (np.random.normal(loc=rot_mean, scale=rot_variance))%(math.pi*2),
-                                        range_=self.sensor_range, aperture=self.sensor_aperture, num_sensors=self.num_sensors) for position in generated_particle_positions_gmm])
+                num_random_particles = round(num_generated_particles * self.generation_split)
+                num_particles_from_gmm = num_generated_particles - num_random_particles
+
+                # print(f"Num random particles {num_random_particles} ; Num gmm particles {num_particles_from_gmm}")
+
+                generated_particle_positions_gmm = self.generate_particle_positions(
+                    top_positions, component_weights, component_variances, num_particles_from_gmm)
             
-            if len(generated_particle_positions_random) > 0:
-                new_particles.extend([Particle(position, random.uniform(0, 2 * math.pi),
-                                        range_=self.sensor_range, aperture=self.sensor_aperture, num_sensors=self.num_sensors) for position in generated_particle_positions_random])
+                sensor_params = particles.sensor_params()
 
-        else:
-            new_particles = particles
+                new_particles = [particles.select(top_indices)]
+
+                if len(generated_particle_positions_gmm) > 0:
+                    gmm_rotations = np.random.normal(
+                        loc=rot_mean, scale=rot_variance, size=len(generated_particle_positions_gmm)) % (math.pi*2)
+                    new_particles.append(ParticleSet.from_poses(
+                        generated_particle_positions_gmm, gmm_rotations, **sensor_params))
+
+                if num_random_particles > 0:
+                    new_particles.append(ParticleSet.uniform(
+                        num_random_particles, self.width, self.height, **sensor_params))
+
+                with profiler.phase('resample.construct'):
+                    new_particles = ParticleSet.concatenate(new_particles)
+
+            else:
+                new_particles = particles
 
         # print(f"Total particles {len(particles)} ; Scores svg {top_scores_avg} ; Variance {gen_variance}; Generation_split {self.generation_split}")
 
-        if save_data:
-            stats_file.write(f"{gen_variance},{self.generation_split},{gen_multiplier},{rot_variance},{top_scores_avg},{np.mean(self.last_scores)},{num_generated_particles}\n")
+        self.resample_stats = {
+            'generation_variance': gen_variance,
+            'generation_split': self.generation_split,
+            'generation_multiplier': gen_multiplier,
+            'rotation_variance': rot_variance,
+            'top_scores_avg': top_scores_avg,
+            'mean_last_scores': mean_last_scores,
+            'num_generated_particles': num_generated_particles,
+        }
 
         if show_data:
             print(f"\n{self.resampling_count}::")
@@ -256,28 +419,191 @@ class Game:
             print(f"Generation multiplier: { gen_multiplier } ;")
             print(f"Rotation variance: { rot_variance } ;")
             print(f"Top scores avg: { top_scores_avg } ;")
-            print(f"Mean last scores: { np.mean(self.last_scores) } ;")
+            print(f"Mean last scores: { mean_last_scores } ;")
             print(f"Num generated particles: { num_generated_particles } ;")
         
-        if show_density or save_density:
-            ax.imshow(density_map, cmap='hot', interpolation='nearest')
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-            if save_density:
-                output_path = os.path.join(density_directory, f'{str(self.resampling_count).zfill(8)}.png')
-                fig.savefig(output_path, bbox_inches='tight')
+        if show_density and components.any():
+            with profiler.phase('resample.density'):
+                density_map = self.density_map(top_positions, component_weights, component_variances)
+                ax.imshow(density_map, cmap='hot', interpolation='nearest')
+                fig.canvas.draw()
+                fig.canvas.flush_events()
+
+        if density_store is not None and components.any():
+            with profiler.phase('resample.density'):
+                density_store.append(
+                    self.density_map(top_positions, component_weights, component_variances,
+                                     step=density_store.downsample),
+                    self.resampling_count)
 
         return new_particles
     
-    def run(self):
-        running = True
+    def estimate_pose(self, particles, weights):
+        weights = np.maximum(weights, 0)
+        if weights.sum() <= 0:
+            weights = np.ones(len(particles))
+
+        position = np.average(particles.get_positions(), axis=0, weights=weights)
+        angle = math.atan2(
+            np.average(np.sin(particles.get_angles()), weights=weights),
+            np.average(np.cos(particles.get_angles()), weights=weights)
+        )
+        return position, angle
+
+    def localization_error(self):
+        if self.pose_estimate is None:
+            self.pose_estimate = self.estimate_pose(self.particles, np.ones(len(self.particles)))
+
+        position, angle = self.pose_estimate
+        position_error = math.dist(position, self.robot.get_position())
+        heading_error = abs((angle - self.robot.get_angle() + math.pi) % (2 * math.pi) - math.pi)
+        return position_error, heading_error
+
+    def controls(self, pressed_keys):
+        speed = 0
+        rotation = 0
+        rot_speed = ROT_SPEED
+
+        if pressed_keys[pygame.K_w]:
+            speed = SPEED
 
-        frame_count = 0
+            if pressed_keys[pygame.K_LSHIFT]:
+                speed *= 2
+                rot_speed *= 3
 
+        if pressed_keys[pygame.K_a]:
+            rotation -= rot_speed
+        if pressed_keys[pygame.K_d]:
+            rotation += rot_speed
 
+        return speed, rotation
+
+    def step(self, speed, rotation, fig_ax=(None, None)):
+        # one simulation step: motion update, robot measurement and, every gen_interval steps, resampling
+        start = time.perf_counter()
+
+        with profiler.phase('step'):
+            with profiler.phase('step.motion'):
+                robot_next_position = self.robot.get_position()
+                next_positions = self.particles.get_positions()
+
+                if speed:
+                    robot_next_position, mnoise = self.robot.move(
+                        speed, position=robot_next_position)
+                    next_positions, _ = self.particles.move(speed, noise=mnoise)
+
+                if rotation:
+                    _, rnoise = self.robot.rotate(math.radians(rotation))
+                    self.particles.rotate(math.radians(rotation), noise=rnoise)
+
+            with profiler.phase('step.collision'):
+                collision = self.wallmap.particle_has_collision(robot_next_position, self.robot.get_radius())
+            if not collision:
+                self.robot.apply_move(robot_next_position)
+                self.particles.apply_move(next_positions)
+
+            with profiler.phase('step.robot_measure'):
+                segments = self.wallmap.get_segments()
+                self.robot.update(segments, caster=self.robot_caster)
+
+                robot_measure = self.robot.measure(segments, caster=self.robot_caster)
+
+            resampled = self.frame_count % self.gen_interval == 0
+            if resampled:
+                resample_start = time.perf_counter()
+                with profiler.phase('resample'):
+                    self.particles = self.generate_particles(self.particles, robot_measure, fig_ax)
+                resample_seconds = time.perf_counter() - resample_start
+        step_seconds = time.perf_counter() - start
+
+        if telemetry is not None:
+            stats = {}
+            if resampled:
+                stats.update(self.resample_stats, resampling=self.resampling_count, resample_seconds=resample_seconds)
+
+            if profiler.memory:
+                stats['step_memory_peak'], stats['step_memory_net'] = profiler.last_memory['step']
+                if resampled:
+                    stats['resample_memory_peak'], stats['resample_memory_net'] = profiler.last_memory['resample']
+                    counts = profiler.memory_counts((Particle, ParticleSet))
+                    stats.update(
+                        particle_objects=counts['Particle'], particle_sets=counts['ParticleSet'],
+                        numpy_blocks=counts['numpy_blocks'], numpy_bytes=counts['numpy_bytes'],
+                        rss_max=counts['rss_max'])
+
+            position_error, heading_error = self.localization_error()
+            telemetry.record(
+                step=self.frame_count,
+                particles=len(self.particles),
+                position_error=position_error,
+                heading_error=math.degrees(heading_error),
+                step_seconds=step_seconds,
+                **stats
+            )
+
+        self.frame_count += 1
+
+        return robot_measure
+
+    def run_headless(self, commands, *, steps=None, converged_error=20.0):
+        # steps repeats the commands cyclically, by default they run once;
+        # the filter converged at the first step after which the position error stays below converged_error
+        steps = len(commands) if steps is None else steps
+
+        fig_ax = self.density_figure()
+
+        convergence_step = None
+        convergence_seconds = None
+
+        start = time.perf_counter()
+        for i in range(steps):
+            speed, rotation = commands[i % len(commands)]
+            self.step(speed, rotation, fig_ax)
+            profiler.frame()
+
+            if self.localization_error()[0] < converged_error:
+                if convergence_step is None:
+                    convergence_step = i + 1
+                    convergence_seconds = time.perf_counter() - start
+            else:
+                convergence_step = convergence_seconds = None
+        elapsed = time.perf_counter() - start
+
+        position_error, heading_error = self.localization_error()
+
+        return {
+            'steps': steps,
+            'seconds': elapsed,
+            'steps_per_second': steps / elapsed if elapsed > 0 else float('inf'),
+            'position_error': position_error,
+            'heading_error': math.degrees(heading_error),
+            'particles': len(self.particles),
+            'convergence_step': convergence_step,
+            'convergence_seconds': convergence_seconds,
+        }
+
+    def filter_bank(self, num_filters, num_particles=None):
+        # independent copies of this game's filter, advanced together over the same map
+        if self.kld_sampler is not None:
+            raise ValueError('KLD sampling changes the particle count of every filter, '
+                             'it is not supported with --filters, set kld = False')
+
+        return FilterBank(
+            self.wallmap, num_filters, num_particles or self.samples,
+            caster=self.particle_caster, robot_caster=self.robot_caster,
+            likelihood_field=self.likelihood_field, resampler=self.resampler_name,
+            gen_interval=self.gen_interval,
+            start_position=self.robot_start_positions[1], start_angle=0.0,
+            gen_variance_max=self.gen_variance_max, gen_variance_min=self.gen_variance_min,
+            generation_split=self.generation_split, max_generation_split=self.max_generation_split,
+            num_last_scores=self.num_last_scores,
+            **self.particles.sensor_params()
+        )
+
+    def density_figure(self):
         fig, ax = None, None
 
-        if show_density or save_density:
+        if show_density:
 
             plt.ion()
 
@@ -295,94 +621,120 @@ class Game:
             fig.canvas.draw()
             fig.canvas.flush_events()
 
+        return fig, ax
 
-        while running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-    
-            pressed_keys = pygame.key.get_pressed()
-    
-            robot_next_position = self.robot.get_position()
-            next_positions = [p.get_position() for p in self.particles]
-    
-            speed = SPEED
-            rot_speed = ROT_SPEED
-    
-            if pressed_keys[pygame.K_w]:
-    
-                if pressed_keys[pygame.K_LSHIFT]:
-                    speed *= 2
-                    rot_speed *= 3
-    
-                robot_next_position, mnoise = self.robot.move(
-                    speed, position=robot_next_position)
-                next_positions = [p.move(speed, noise=mnoise)[0]
-                                for p in self.particles]
-    
-            if pressed_keys[pygame.K_a]:
-                _, lnoise = self.robot.rotate(math.radians(-rot_speed))
-                for p in self.particles:
-                    p.rotate(math.radians(-rot_speed), noise=lnoise)
-            if pressed_keys[pygame.K_d]:
-                _, rnoise = self.robot.rotate(math.radians(rot_speed))
-                for p in self.particles:
-                    p.rotate(math.radians(rot_speed), noise=rnoise)
-    
-            if not self.wallmap.particle_has_collision(robot_next_position, self.robot.get_radius()):
-                self.robot.apply_move(robot_next_position)
-                for p, position in zip(self.particles, next_positions):
-                    p.apply_move(position)
-    
-            # Clear
-    
-            self.screen.fill(WHITE)
-    
-            # Update
-    
-            surrounding_cells, surrounding_edges = self.get_surrounding_cells_edges(
-                self.robot)
-            self.robot.update(surrounding_edges, grid_size=self.grid_size)
-    
-            robot_measure = self.robot.measure(surrounding_edges)
+    def run(self):
+        running = True
 
-            if frame_count % GEN_INTERVAL == 0:
-              self.particles = self.generate_particles(self.particles, robot_measure, (fig,ax))
+        fig_ax = self.density_figure()
 
-            Particle.draw_robot(self.screen, self.robot, color=(148, 0, 211), draw_lasers=self.view_laser, draw_laser_outlines=self.view_laser_outline)
+        recorder = None
+        if save_frames:
+            recorder = FrameRecorder(record_directory, (self.width, self.height), format=record_format, fps=FPS)
+            # Ctrl+C exits through sys.exit, the queued frames are still written
+            atexit.register(recorder.close)
 
-            for p in self.particles:
-                Particle.draw_particle(self.screen, p)
+        filter_thread = None
+        if self.threaded_filter:
+            # the density window, the memory tracing and cProfile only cover the render loop
+            if show_density or profiler.memory or profiler.cprofile is not None:
+                print('The filter runs in the render loop with --show_density, --profile_memory and --profile_frames')
+            else:
+                filter_thread = FilterThread(self, rate=self.filter_rate)
+                filter_thread.start()
+                # stops the worker on Ctrl+C before the telemetry and density store it writes to are closed
+                atexit.register(filter_thread.stop)
 
-            self.wallmap.draw(self.screen)
+        # frames are recorded under their own index, a filter step can be shown over several frames
+        render_frame_count = 0
 
-            if self.cell_range_viz:
-                for key, _ in surrounding_cells:
-                    cell_x, cell_y = key.split(';')
-                    cell_x = int(cell_x) * self.grid_size
-                    cell_y = int(cell_y) * self.grid_size
-                    s = pygame.Surface((20, 20), pygame.SRCALPHA)
-                    # notice the alpha value in the color
-                    s.fill((0, 255, 0, 50))
+        while running:
+            frame_start = time.perf_counter()
 
-                    self.screen.blit(s, (cell_x, cell_y))
+            with profiler.phase('frame.events'):
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+    
+                speed, rotation = self.controls(pygame.key.get_pressed())
+
+            if filter_thread is None:
+                self.step(speed, rotation, fig_ax)
+
+                with profiler.phase('frame.draw'):
+                    self.draw(
+                        self.robot.position, self.robot.angle, self.robot.radius,
+                        tuple(self.robot.compute_sensor_points(self.robot.measurements)), self.particles)
+            else:
+                filter_thread.set_controls(speed, rotation)
+                if filter_thread.error is not None:
+                    running = False
+
+                with profiler.phase('frame.draw'), filter_thread.poses.read() as poses:
+                    self.draw(poses.robot_position, poses.robot_angle, poses.robot_radius,
+                              poses.sensor_points, poses)
 
             # Refresh the display
-            pygame.display.flip()
+            with profiler.phase('frame.flip'):
+                pygame.display.flip()
+
+            # time spent on the frame itself, before waiting for the frame rate cap
+            profiler.add('frame', time.perf_counter() - frame_start)
 
             # Cap the frame rate
-            self.clock.tick(FPS)
+            with profiler.phase('frame.tick'):
+                self.clock.tick(FPS)
             # print(f'FPS {self.clock.get_fps()}')
 
-            if save_frames:
-                pygame.image.save(self.screen, f"{record_directory}/{str(frame_count).zfill(8)}.png")
+            if recorder is not None:
+                with profiler.phase('frame.record'):
+                    recorder.capture(self.screen, render_frame_count)
+            render_frame_count += 1
+
+            profiler.frame()
 
-            frame_count += 1
+        if filter_thread is not None:
+            filter_thread.stop()
 
+        if recorder is not None:
+            recorder.close()
 
         pygame.quit()
         sys.exit()
 
+    def draw(self, robot_position, robot_angle, robot_radius, sensor_points, particles):
+        # Clear
+        if self.wall_density_viz:
+            self.screen.blit(self.wallmap.get_layer('tiles'), (0, 0))
+        else:
+            self.screen.fill(WHITE)
+
+        Particle.draw_pose(self.screen, robot_position, robot_angle, robot_radius, sensor_points,
+                           color=(148, 0, 211), draw_lasers=self.view_laser, draw_laser_outlines=self.view_laser_outline)
+
+        with profiler.phase('frame.draw.particles'):
+            ParticleSet.draw_particles(
+                self.screen, particles, heatmap_threshold=self.particle_heatmap_threshold)
+
+        with profiler.phase('frame.draw.walls'):
+            self.wallmap.draw(self.screen)
+
+        if self.cell_range_viz:
+            with profiler.phase('frame.draw.cells'):
+                # from the drawn pose, the filter thread may be moving the robot meanwhile
+                surrounding_cells = self.wallmap.get_surrounding_cells(
+                    robot_position, mode='aperture', range_=self.sensor_range,
+                    angle=robot_angle, aperture=self.sensor_aperture * 1.2)
+                for cell, _ in surrounding_cells:
+                    cell_x, cell_y = self.wallmap.cell_position(cell)
+                    cell_x = cell_x * self.grid_size
+                    cell_y = cell_y * self.grid_size
+                    s = pygame.Surface((20, 20), pygame.SRCALPHA)
+                    # notice the alpha value in the color
+                    s.fill((0, 255, 0, 50))
+
+                    self.screen.blit(s, (cell_x, cell_y))
+
 
 
 
@@ -396,7 +748,13 @@ def read_config(file_path, sim_settings_name):
     view_laser = config.getboolean('EnvironmentSettings', 'view_laser')
     view_laser_outline = config.getboolean(
         'EnvironmentSettings', 'view_laser_outline')
+    index_backend = config.get(
+        'EnvironmentSettings', 'index_backend', fallback='grid')
+    map_cache = config.get(
+        'EnvironmentSettings', 'map_cache', fallback='')
 
+    particle_heatmap_threshold = config.getint(
+        'EnvironmentSettings', 'particle_heatmap_threshold', fallback=2000)
     wall_density_viz = config.getboolean(
         'DebugSettings', 'wall_density_viz')
     cell_range_viz = config.getboolean(
@@ -406,6 +764,54 @@ def read_config(file_path, sim_settings_name):
     sensor_aperture = math.radians(config.getint(
         sim_settings_name, 'sensor_aperture'))
     num_sensors = config.getint(sim_settings_name, 'num_sensors')
+    samples = config.getint(sim_settings_name, 'samples', fallback=SAMPLES)
+    gen_interval = config.getint(sim_settings_name, 'gen_interval', fallback=GEN_INTERVAL)
+
+    resampler = config.get(
+        'FilterSettings', 'resampler', fallback='multinomial')
+
+    kld = config.getboolean(sim_settings_name, 'kld', fallback=False)
+    kld_epsilon = config.getfloat(sim_settings_name, 'kld_epsilon', fallback=0.05)
+    kld_z = config.getfloat(sim_settings_name, 'kld_z', fallback=2.33)
+    kld_bin_size = config.getfloat(sim_settings_name, 'kld_bin_size', fallback=20)
+    kld_bin_angle = math.radians(config.getfloat(
+        sim_settings_name, 'kld_bin_angle', fallback=20))
+    kld_min_particles = config.getint(sim_settings_name, 'kld_min_particles', fallback=50)
+    kld_max_particles = config.getint(sim_settings_name, 'kld_max_particles', fallback=50000)
+    sensor_model = config.get(
+        'FilterSettings', 'sensor_model', fallback='beam')
+    likelihood_field_resolution = config.getint(
+        'FilterSettings', 'likelihood_field_resolution', fallback=5)
+    likelihood_field_sigma = config.getfloat(
+        'FilterSettings', 'likelihood_field_sigma', fallback=10.0)
+
+    ray_caster = config.get(
+        'FilterSettings', 'ray_caster', fallback='brute')
+    backend = config.get(
+        'FilterSettings', 'backend', fallback='numpy')
+    threaded_filter = config.getboolean(
+        'FilterSettings', 'threaded_filter', fallback=False)
+    filter_rate = config.getfloat(
+        'FilterSettings', 'filter_rate', fallback=FPS)
+
+    parallel_workers = config.getint(
+        'FilterSettings', 'parallel_workers', fallback=0)
+    parallel_threshold = config.getint(
+        'FilterSettings', 'parallel_threshold', fallback=20000)
+    if parallel_workers and ray_caster not in ('brute', 'dda'):
+        raise ValueError(f'parallel_workers only shards the brute and dda ray casters, not {ray_caster}; '
+                         f'set parallel_workers = 0 or ray_caster = brute or dda')
+
+    range_table = config.getboolean(
+        'FilterSettings', 'range_table', fallback=False)
+    range_table_resolution = config.getint(
+        'FilterSettings', 'range_table_resolution', fallback=10)
+    range_table_headings = config.getint(
+        'FilterSettings', 'range_table_headings', fallback=72)
+    range_table_interpolation = config.get(
+        'FilterSettings', 'range_table_interpolation', fallback='nearest')
+    range_table_dtype = config.get(
+        'FilterSettings', 'range_table_dtype', fallback='float32')
 
     return {
         'environment_id': environment_id,
@@ -413,11 +819,38 @@ def read_config(file_path, sim_settings_name):
         'particle_size': particle_size,
         'view_laser': view_laser,
         'view_laser_outline': view_laser_outline,
+        'index_backend': index_backend,
+        'map_cache': map_cache,
+        'particle_heatmap_threshold': particle_heatmap_threshold,
         'wall_density_viz': wall_density_viz,
         'cell_range_viz': cell_range_viz,
         'sensor_range': sensor_range,
         'sensor_aperture': sensor_aperture,
-        'num_sensors': num_sensors
+        'num_sensors': num_sensors,
+        'samples': samples,
+        'gen_interval': gen_interval,
+        'resampler': resampler,
+        'kld': kld,
+        'kld_epsilon': kld_epsilon,
+        'kld_z': kld_z,
+        'kld_bin_size': kld_bin_size,
+        'kld_bin_angle': kld_bin_angle,
+        'kld_min_particles': kld_min_particles,
+        'kld_max_particles': kld_max_particles,
+        'sensor_model': sensor_model,
+        'likelihood_field_resolution': likelihood_field_resolution,
+        'likelihood_field_sigma': likelihood_field_sigma,
+        'ray_caster': ray_caster,
+        'backend': backend,
+        'threaded_filter': threaded_filter,
+        'filter_rate': filter_rate,
+        'parallel_workers': parallel_workers,
+        'parallel_threshold': parallel_threshold,
+        'range_table': range_table,
+        'range_table_resolution': range_table_resolution,
+        'range_table_headings': range_table_headings,
+        'range_table_interpolation': range_table_interpolation,
+        'range_table_dtype': range_table_dtype
     }
 
 
@@ -440,26 +873,59 @@ if __name__ == "__main__":
                         help='Whether to show data')
     parser.add_argument('--save_frames', action='store_true',
                         help='Whether to save frames')
+    parser.add_argument('--record_format', choices=('png', 'raw', 'zlib'), default='png',
+                        help='PNG sequence or a single raw or zlib compressed frames.mcl container')
     parser.add_argument('--show_density', action='store_true',
                         help='Whether to show data')
     parser.add_argument('--save_density', action='store_true',
-                        help='')
+                        help='Whether to save the density maps to a density store')
+    parser.add_argument('--density_downsample', type=int, default=1,
+                        help='Keep every n-th pixel of the saved density maps')
+    parser.add_argument('--density_compress', action='store_true',
+                        help='Store the density chunks compressed instead of memory-mappable')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print p50/p95/p99 wall times per simulation phase at exit')
+    parser.add_argument('--profile_frames', type=int, default=0,
+                        help='Also run cProfile over this many frames, written to --profile_output')
+    parser.add_argument('--profile_output', type=str, default='profile.prof',
+                        help='Path of the cProfile stats file')
+    parser.add_argument('--profile_memory', action='store_true',
+                        help='Trace allocations per phase with tracemalloc, reported with --profile and in --save_data stats')
+    parser.add_argument('--headless', action='store_true',
+                        help='Run without a display, as fast as possible, following a scripted trajectory')
+    parser.add_argument('--trajectory', type=str, default=None,
+                        help='Path to a trajectory file for headless runs, defaults to a built-in path')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='Number of headless steps, the trajectory is repeated as needed')
+    parser.add_argument('--filters', type=int, default=1,
+                        help='Number of independent filters advanced together in a headless run')
     args = parser.parse_args()
 
     save_data = args.save_data
     show_data = args.show_data
     save_frames = args.save_frames
+    record_format = args.record_format
     save_density = args.save_density
     show_density = args.show_density
     config_data = read_config(args.config, args.sim_settings)
 
+    if args.profile_memory:
+        profiler.enable_memory()
+
+    if args.profile or args.profile_frames or args.profile_memory:
+        profiler.enabled = True
+        # registered first so it runs last, once the other exit handlers are done
+        atexit.register(profiler.report)
+        if args.profile_frames:
+            profiler.start_cprofile(args.profile_frames, args.profile_output)
+
 
     time_id = datetime.now().strftime("%Y%m%d%H%M%S")
 
     if save_data:
-        # open file with append and create file if it doesn't exist
-        stats_file = open(f"./stats/simulation_statistics{time_id}.csv", "a+")
-        stats_file.write("generation_variance,generation_split,generation_multiplier,rotation_variance,top_scores_avg,mean_last_scores,num_generated_particles\n")
+        # export to CSV with: python src/telemetry.py <file> --csv <csv file>
+        telemetry = Telemetry(STATS_COLUMNS, f"./stats/simulation_statistics{time_id}.mclt")
+        atexit.register(telemetry.close)
 
     if save_frames:
         record_directory = f"./frames/frames_{time_id}"
@@ -468,6 +934,35 @@ if __name__ == "__main__":
     if save_density:
         density_directory = f"./density/density_{time_id}"
         os.mkdir(density_directory)
+        density_store = DensityStore(
+            density_directory, downsample=args.density_downsample, compress=args.density_compress)
+        atexit.register(density_store.close)
+
+    if args.headless and args.filters > 1:
+        game = Game(config_data, headless=True)
+        results = game.filter_bank(args.filters).run(load_trajectory(args.trajectory), steps=args.steps)
+
+        print(f"Filters: {results['filters']} x {results['particles']} particles ; "
+              f"Steps: {results['steps']} in {results['seconds']:.2f}s "
+              f"({results['steps_per_second']:.1f} steps/s)")
+        print(f"Position error: median {np.median(results['position_errors']):.2f}px, "
+              f"max {np.max(results['position_errors']):.2f}px ; "
+              f"Heading error: median {np.median(results['heading_errors']):.2f}deg")
+        sys.exit()
+
+    if args.headless:
+        game = Game(config_data, headless=True)
+        results = game.run_headless(load_trajectory(args.trajectory), steps=args.steps)
+
+        print(f"Steps: {results['steps']} in {results['seconds']:.2f}s "
+              f"({results['steps_per_second']:.1f} steps/s)")
+        print(f"Position error: {results['position_error']:.2f}px ; "
+              f"Heading error: {results['heading_error']:.2f}deg ; "
+              f"Particles: {results['particles']}")
+        if results['convergence_step'] is not None:
+            print(f"Converged at step {results['convergence_step']} "
+                  f"({results['convergence_seconds']:.2f}s)")
+        sys.exit()
 
     game = Game(config_data)
     game.run()
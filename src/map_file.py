@@ -0,0 +1,111 @@
+# maps stored as JSON files, with their derived arrays cached on disk
+#
+# a map file gives the dimensions, the grid size and the walls, as groups of edges in grid
+# units; a group with a color is also drawn as a filled obstacle. everything derived from
+# the walls (tile index, distance grids, range tables) is saved as .npy files in a cache
+# directory named after the hash of the map file, and memory-mapped when loaded again
+#
+#   python map_file.py maps/environment_1.json --cache maps/cache
+#
+# prebuilds the tile index of a map into the cache
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import wallmap as wallmap_module
+
+# bumped whenever the layout of the cached arrays changes, older caches are then ignored
+CACHE_VERSION = 1
+
+
+class MapCache:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def load(self, name):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+    def save(self, name, array):
+        # written next to its final path and renamed, a concurrent reader never sees half an array
+        path = self.path(name)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as array_file:
+            np.save(array_file, np.ascontiguousarray(array))
+        os.replace(temporary_path, path)
+
+    def load_or_build(self, name, build):
+        array = self.load(name)
+        if array is None:
+            self.save(name, build())
+            array = self.load(name)
+        return array
+
+
+def map_hash(data):
+    return hashlib.sha1(data + f'\0{CACHE_VERSION}'.encode()).hexdigest()
+
+
+def load_map(path, *, index_backend='grid', cache_directory=None):
+    with open(path, 'rb') as map_file:
+        data = map_file.read()
+    description = json.loads(data)
+
+    wallmap = wallmap_module.Wallmap(
+        grid_size=description['grid_size'], width=description['width'], height=description['height'],
+        index_backend=index_backend)
+
+    segments = np.array(
+        [edge for wall in description['walls'] for edge in wall['edges']], dtype=np.float64).reshape(-1, 4)
+    edges = [wallmap_module.Edge(segment[:2], segment[2:]) for segment in segments]
+
+    groups = []
+    start = 0
+    for wall in description['walls']:
+        groups.append((edges[start:start + len(wall['edges'])], wall.get('color')))
+        start += len(wall['edges'])
+
+    if cache_directory is None:
+        wallmap.add_edges(edges, segments=segments)
+    else:
+        name = os.path.splitext(os.path.basename(path))[0]
+        wallmap.cache = MapCache(os.path.join(cache_directory, f'{name}-{map_hash(data)[:16]}'))
+
+        offsets = wallmap.cache.load('cell_offsets')
+        if offsets is None:
+            wallmap.add_edges(edges, segments=segments)
+            offsets, cell_edges = wallmap.get_index()
+            # the offsets go last, their file marks a complete index
+            wallmap.cache.save('cell_edges', cell_edges)
+            wallmap.cache.save('cell_offsets', offsets)
+        else:
+            wallmap.load_index(edges, segments, offsets, wallmap.cache.load('cell_edges'))
+
+    for group_edges, color in groups:
+        if color is not None:
+            wallmap.add_obstacle(wallmap_module.Obstacle(group_edges, tuple(color)))
+
+    return wallmap
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the cached tile index of a map file')
+    parser.add_argument('map', type=str,
+                        help='Path to the .json map file')
+    parser.add_argument('--cache', type=str, required=True,
+                        help='Cache directory')
+    args = parser.parse_args()
+
+    wallmap = load_map(args.map, cache_directory=args.cache)
+    print(f'{len(wallmap.edges)} edges cached in {wallmap.cache.directory}')
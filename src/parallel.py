@@ -0,0 +1,149 @@
+import atexit
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import raycast
+
+# map arrays attached once per worker process, keyed by name
+_worker_arrays = {}
+# particle buffers attached by the workers, keyed by shared memory name
+_worker_buffers = {}
+
+
+def _init_worker(map_specs, geometry):
+    # pool workers share the resource tracker of the parent, which unlinks the blocks
+    for key, (name, shape, dtype) in map_specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_arrays[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+    _worker_arrays['geometry'] = (None, geometry)
+
+
+def _worker_buffer(name, shape, dtype):
+    if name not in _worker_buffers:
+        _worker_buffers[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=_worker_buffers[name].buf)
+
+
+def _worker_cast(task):
+    start, stop, poses_spec, ranges_spec, params = task
+
+    poses = _worker_buffer(*poses_spec)
+    ranges = _worker_buffer(*ranges_spec)
+
+    segments = _worker_arrays['segments'][1]
+    beams = raycast.sensor_angles(poses[2, start:stop], params['aperture'], params['num_sensors'])
+
+    if 'cell_offsets' in _worker_arrays:
+        geometry = _worker_arrays['geometry'][1]
+        result = raycast.march(
+            np.repeat(poses[0, start:stop], params['num_sensors']),
+            np.repeat(poses[1, start:stop], params['num_sensors']),
+            beams.ravel(), segments,
+            _worker_arrays['cell_offsets'][1], _worker_arrays['cell_edges'][1],
+            range_=params['range_'], **geometry
+        ).reshape(beams.shape)
+    else:
+        result = raycast.cast_beams(
+            poses[0, start:stop], poses[1, start:stop], beams, segments, range_=params['range_'])
+
+    ranges[start:stop, :params['num_sensors']] = result
+    return stop - start
+
+
+class ParallelCaster:
+    # shards particle ray casting across a process pool; the wallmap arrays live in
+    # shared memory for the whole run and poses and ranges move through shared buffers,
+    # so each call only sends a few slice bounds to the workers
+
+    def __init__(self, wallmap, *, workers=None, threshold=20000, ray_caster='brute', shard_size=None):
+        if ray_caster not in ('brute', 'dda'):
+            raise ValueError(f'Invalid ray caster {ray_caster} for ParallelCaster')
+
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.shard_size = shard_size
+
+        # in-process caster used below the threshold, when the pool would not pay off
+        self.local_caster = raycast.GridMarcher(wallmap) if ray_caster == 'dda' else None
+        self.segments = wallmap.get_segments()
+
+        self.blocks = []
+        map_arrays = {'segments': self.segments}
+        geometry = {}
+        if ray_caster == 'dda':
+            map_arrays['cell_offsets'], map_arrays['cell_edges'] = wallmap.get_index()
+            geometry = {'nx': wallmap.nx, 'ny': wallmap.ny, 'cell_size': wallmap.grid_size}
+
+        map_specs = {}
+        for key, array in map_arrays.items():
+            _, spec = self.share(array)
+            map_specs[key] = spec
+
+        self.capacity = 0
+        self.poses = None
+        self.ranges = None
+        self.poses_spec = None
+        self.ranges_spec = None
+
+        # workers start from a fork server: a plain fork would copy this process along with
+        # the state of whatever threads it runs, including the locks they hold
+        context = multiprocessing.get_context('forkserver')
+        self.pool = context.Pool(self.workers, initializer=_init_worker, initargs=(map_specs, geometry))
+        atexit.register(self.close)
+
+    def share(self, array):
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        self.blocks.append(block)
+        return shared, (block.name, array.shape, array.dtype.str)
+
+    def reserve(self, num_particles, num_sensors):
+        if num_particles <= self.capacity and self.ranges.shape[1] >= num_sensors:
+            return
+
+        # grow geometrically so a slowly increasing particle count does not reallocate every step
+        self.capacity = max(num_particles, 2 * self.capacity)
+        width = max(num_sensors, self.ranges.shape[1] if self.ranges is not None else 0)
+        self.poses, self.poses_spec = self.share(np.zeros((3, self.capacity)))
+        self.ranges, self.ranges_spec = self.share(np.zeros((self.capacity, width)))
+
+    def cast_rays(self, xs, ys, angles, *, range_, aperture, num_sensors):
+        num_particles = len(xs)
+        if num_particles < self.threshold:
+            if self.local_caster is not None:
+                return self.local_caster.cast_rays(
+                    xs, ys, angles, range_=range_, aperture=aperture, num_sensors=num_sensors)
+            return raycast.cast_rays(
+                xs, ys, angles, self.segments, range_=range_, aperture=aperture, num_sensors=num_sensors)
+
+        self.reserve(num_particles, num_sensors)
+        self.poses[0, :num_particles] = xs
+        self.poses[1, :num_particles] = ys
+        self.poses[2, :num_particles] = angles
+
+        params = {'range_': range_, 'aperture': aperture, 'num_sensors': num_sensors}
+        shard_size = self.shard_size or -(-num_particles // (4 * self.workers))
+        tasks = [
+            (start, min(start + shard_size, num_particles), self.poses_spec, self.ranges_spec, params)
+            for start in range(0, num_particles, shard_size)
+        ]
+        self.pool.map(_worker_cast, tasks)
+
+        return self.ranges[:num_particles, :num_sensors].copy()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+        # buffers replaced by reserve are kept until here, the workers may still map them
+        self.poses = self.ranges = None
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
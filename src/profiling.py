@@ -0,0 +1,203 @@
+# per phase wall time histograms
+#
+# every phase keeps its call count, total time and a histogram with log-spaced buckets
+# (PHASE_BUCKETS_PER_DECADE per decade from 1us to 100s), enough for percentiles within a
+# few percent without storing the samples; a disabled profiler costs one attribute check.
+#
+# the opt-in memory mode traces allocations with tracemalloc: every phase also records the
+# peak of traced memory above its starting point, which counts the temporaries freed before
+# the phase ends, and the net growth it leaves behind
+
+import cProfile
+import gc
+import math
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+PHASE_MIN_SECONDS = 1e-6
+PHASE_DECADES = 8
+PHASE_BUCKETS_PER_DECADE = 32
+
+
+class _Phase:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+        self.memory_start = 0
+        self.memory_peak = 0
+
+    def __enter__(self):
+        if self.profiler.memory:
+            self.memory_start = self.memory_peak = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            self.profiler.memory_stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+
+        if self.profiler.memory:
+            # a nested phase resets the tracemalloc peak, its own peak was passed up on exit
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self.memory_peak)
+            self.profiler.memory_stack.pop()
+            if self.profiler.memory_stack:
+                parent = self.profiler.memory_stack[-1]
+                parent.memory_peak = max(parent.memory_peak, peak)
+            self.profiler.add_memory(self.name, peak - self.memory_start, current - self.memory_start)
+        return False
+
+
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+class Profiler:
+
+    def __init__(self, *, enabled=False):
+        self.enabled = enabled
+        self.phases = {}
+        self.calls = {}
+        self.totals = {}
+        self.histograms = {}
+
+        self.memory = False
+        self.memory_stack = []
+        self.memory_peaks = {}
+        self.memory_nets = {}
+        self.last_memory = {}
+
+        self.cprofile = None
+        self.cprofile_frames = 0
+        self.cprofile_path = None
+        self.frame_count = 0
+
+    def phase(self, name):
+        if not self.enabled:
+            return _null_phase
+
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(self, name)
+        return phase
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = np.zeros(PHASE_DECADES * PHASE_BUCKETS_PER_DECADE + 1, dtype=np.int64)
+            self.calls[name] = 0
+            self.totals[name] = 0.0
+
+        bucket = 0
+        if seconds > PHASE_MIN_SECONDS:
+            bucket = min(int(math.log10(seconds / PHASE_MIN_SECONDS) * PHASE_BUCKETS_PER_DECADE) + 1,
+                         len(histogram) - 1)
+        histogram[bucket] += 1
+        self.calls[name] += 1
+        self.totals[name] += seconds
+
+    def enable_memory(self):
+        # one frame per trace is enough for byte counts and keeps the tracing overhead low
+        self.enabled = True
+        self.memory = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+
+    def add_memory(self, name, peak, net):
+        if name not in self.memory_peaks:
+            self.memory_peaks[name] = []
+            self.memory_nets[name] = 0
+        self.memory_peaks[name].append(peak)
+        self.memory_nets[name] += net
+        self.last_memory[name] = (peak, net)
+
+    def memory_counts(self, types=()):
+        # live instances of every given type, live numpy data buffers and the peak RSS in bytes;
+        # walks every tracked object and trace, meant for once per resample rather than per phase
+        counts = {}
+        if types:
+            objects = gc.get_objects()
+            for kind in types:
+                counts[kind.__name__] = sum(1 for obj in objects if type(obj) is kind)
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)])
+        counts['numpy_blocks'] = len(snapshot.traces)
+        counts['numpy_bytes'] = sum(trace.size for trace in snapshot.traces)
+
+        # ru_maxrss is in kilobytes on linux and in bytes on macos
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        counts['rss_max'] = rss if sys.platform == 'darwin' else rss * 1024
+        return counts
+
+    def percentiles(self, name, qs=(50, 95, 99)):
+        # upper edge of the bucket holding every percentile, in seconds
+        counts = np.cumsum(self.histograms[name])
+        buckets = np.searchsorted(counts, np.array(qs) / 100 * counts[-1], side='left')
+        return PHASE_MIN_SECONDS * 10 ** (buckets / PHASE_BUCKETS_PER_DECADE)
+
+    def start_cprofile(self, frames, path):
+        # cProfile over the next frames, dumped as a pstats file (snakeviz, flameprof, gprof2dot)
+        self.cprofile = cProfile.Profile()
+        self.cprofile_frames = frames
+        self.cprofile_path = path
+        self.cprofile.enable()
+
+    def frame(self):
+        self.frame_count += 1
+        if self.cprofile is not None and self.frame_count >= self.cprofile_frames:
+            self.stop_cprofile()
+
+    def stop_cprofile(self):
+        if self.cprofile is None:
+            return
+        self.cprofile.disable()
+        self.cprofile.dump_stats(self.cprofile_path)
+        print(f'cProfile of {self.frame_count} frames written to {self.cprofile_path}')
+        self.cprofile = None
+
+    def report(self):
+        self.stop_cprofile()
+        if not self.calls:
+            return
+
+        width = max(len(name) for name in self.calls)
+        memory_header = f"  {'peak KB':>10}  {'max KB':>10}  {'net KB':>10}" if self.memory else ''
+        print(f"{'phase':<{width}}  {'calls':>8}  {'total s':>9}  {'mean ms':>9}  "
+              f"{'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}" + memory_header)
+        for name in sorted(self.calls, key=self.totals.get, reverse=True):
+            p50, p95, p99 = self.percentiles(name) * 1e3
+            mean = self.totals[name] / self.calls[name] * 1e3
+            line = (f'{name:<{width}}  {self.calls[name]:>8}  {self.totals[name]:>9.3f}  {mean:>9.3f}  '
+                    f'{p50:>9.3f}  {p95:>9.3f}  {p99:>9.3f}')
+            if name in self.memory_peaks:
+                peaks = self.memory_peaks[name]
+                line += (f'  {sum(peaks) / len(peaks) / 1024:>10.1f}  {max(peaks) / 1024:>10.1f}  '
+                         f'{self.memory_nets[name] / 1024:>10.1f}')
+            print(line)
+
+        if self.memory:
+            counts = self.memory_counts()
+            print(f"live numpy buffers: {counts['numpy_blocks']} ({counts['numpy_bytes'] / 1024:.1f} KB) ; "
+                  f"peak RSS: {counts['rss_max'] / 2**20:.1f} MB")
+
+
+profiler = Profiler()
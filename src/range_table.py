@@ -0,0 +1,79 @@
+import math
+import time
+
+import numpy as np
+
+import raycast
+
+
+class RangeTable:
+    # expected range for every (cell, quantized heading) of a wallmap, cast once
+    # so that particle measurements become array gathers instead of ray casts
+
+    def __init__(self, wallmap, *, range_, resolution=10, num_headings=72,
+                 interpolation='nearest', dtype=np.float32):
+
+        if interpolation not in ('nearest', 'bilinear'):
+            raise ValueError(f'Invalid interpolation {interpolation} for RangeTable')
+
+        self.range_ = range_
+        self.resolution = resolution
+        self.num_headings = num_headings
+        self.interpolation = interpolation
+
+        self.nx = math.ceil(wallmap.width / resolution)
+        self.ny = math.ceil(wallmap.height / resolution)
+        self.heading_step = 2 * math.pi / num_headings
+
+        start = time.perf_counter()
+        self.table = wallmap.cached(
+            f'range_table_{resolution}_{num_headings}_{range_}_{np.dtype(dtype).name}',
+            lambda: self.build(wallmap.get_segments()).astype(dtype))
+        self.build_time = time.perf_counter() - start
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def build(self, segments):
+        cx, cy = np.meshgrid(
+            (np.arange(self.nx) + 0.5) * self.resolution,
+            (np.arange(self.ny) + 0.5) * self.resolution
+        )
+        headings = np.arange(self.num_headings) * self.heading_step
+        beams = np.broadcast_to(headings, (cx.size, self.num_headings))
+
+        ranges = raycast.cast_beams(cx.ravel(), cy.ravel(), beams, segments, range_=self.range_)
+        return ranges.reshape(self.ny, self.nx, self.num_headings)
+
+    def lookup(self, xs, ys, beams):
+        # xs, ys are (P,) and beams is (P, S), returns ranges shaped like beams
+        headings = np.rint(beams / self.heading_step).astype(np.intp) % self.num_headings
+
+        fx = np.asarray(xs)[:, None] / self.resolution
+        fy = np.asarray(ys)[:, None] / self.resolution
+
+        if self.interpolation == 'nearest':
+            ix = np.clip(fx.astype(np.intp), 0, self.nx - 1)
+            iy = np.clip(fy.astype(np.intp), 0, self.ny - 1)
+            ranges = self.table[iy, ix, headings]
+        else:
+            # interpolate between the four closest cell centers
+            fx = np.clip(fx - 0.5, 0, self.nx - 1)
+            fy = np.clip(fy - 0.5, 0, self.ny - 1)
+            x0 = np.minimum(fx.astype(np.intp), self.nx - 2 if self.nx > 1 else 0)
+            y0 = np.minimum(fy.astype(np.intp), self.ny - 2 if self.ny > 1 else 0)
+            x1 = np.minimum(x0 + 1, self.nx - 1)
+            y1 = np.minimum(y0 + 1, self.ny - 1)
+            wx = fx - x0
+            wy = fy - y0
+
+            top = self.table[y0, x0, headings] * (1 - wx) + self.table[y0, x1, headings] * wx
+            bottom = self.table[y1, x0, headings] * (1 - wx) + self.table[y1, x1, headings] * wx
+            ranges = top * (1 - wy) + bottom * wy
+
+        return np.minimum(ranges.astype(np.float64), self.range_)
+
+    def cast_rays(self, xs, ys, angles, *, range_, aperture, num_sensors):
+        ranges = self.lookup(xs, ys, raycast.sensor_angles(angles, aperture, num_sensors))
+        return np.minimum(ranges, range_)
@@ -0,0 +1,221 @@
+import numpy as np
+
+import kernels
+
+# upper bound on the number of (ray, segment) pairs evaluated at once,
+# keeps the temporaries of a batch at a few tens of MB
+MAX_BATCH_PAIRS = 1 << 21
+
+
+def as_segments(walls, grid_size=20):
+    # walls are either an (E, 4) array of x1, y1, x2, y2 in pixels
+    # or an iterable of wallmap.Edge given in grid units
+    if isinstance(walls, np.ndarray):
+        return walls
+
+    segments = [(*wall.pos1, *wall.pos2) for wall in walls]
+    return np.array(segments, dtype=np.float64).reshape(-1, 4) * grid_size
+
+
+def sensor_angles(angles, aperture, num_sensors):
+    offsets = np.linspace(-aperture / 2.0, aperture / 2.0, num=num_sensors)
+    return np.asarray(angles, dtype=np.float64)[:, None] + offsets
+
+
+def cast_rays(xs, ys, angles, segments, *, range_, aperture, num_sensors):
+    return cast_beams(xs, ys, sensor_angles(angles, aperture, num_sensors), segments, range_=range_)
+
+
+def cast_beams(xs, ys, beams, segments, *, range_):
+    # beams holds one row of absolute beam angles per origin
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    ranges = np.full(beams.shape, float(range_))
+    if len(xs) == 0 or len(segments) == 0:
+        return ranges
+
+    if kernels.use_numba():
+        return kernels.cast_beams(xs, ys, beams, segments, range_)
+
+    batch = max(1, MAX_BATCH_PAIRS // (beams.shape[1] * len(segments)))
+    for start in range(0, len(xs), batch):
+        stop = start + batch
+        ranges[start:stop] = _cast_batch(
+            xs[start:stop], ys[start:stop], beams[start:stop], segments, range_)
+
+    return ranges
+
+
+def _cast_batch(xs, ys, beams, segments, range_):
+    # ray: o + t * d, segment: a + u * e, both solved through 2d cross products
+    dx = np.cos(beams)[:, :, None]
+    dy = np.sin(beams)[:, :, None]
+
+    ax = segments[:, 0] - xs[:, None, None]
+    ay = segments[:, 1] - ys[:, None, None]
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+
+    denom = dx * ey - dy * ex
+    parallel = denom == 0
+    denom = np.where(parallel, 1.0, denom)
+
+    t = (ax * ey - ay * ex) / denom
+    u = (ax * dy - ay * dx) / denom
+
+    hit = ~parallel & (t >= 0) & (t <= range_) & (u >= 0) & (u <= 1)
+    t = np.where(hit, t, range_)
+
+    return t.min(axis=2)
+
+
+class GridMarcher:
+    # walks the wallmap cells along each beam (Amanatides & Woo) and only tests
+    # the edges stored in the cells crossed, stopping at the first hit
+
+    def __init__(self, wallmap):
+        self.cell_size = wallmap.grid_size
+        self.nx = wallmap.nx
+        self.ny = wallmap.ny
+        self.segments = wallmap.get_segments()
+        self.cell_offsets, self.cell_edges = wallmap.get_index()
+
+    def cast_rays(self, xs, ys, angles, *, range_, aperture, num_sensors):
+        return self.cast_beams(xs, ys, sensor_angles(angles, aperture, num_sensors), range_=range_)
+
+    def cast_beams(self, xs, ys, beams, *, range_):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+
+        ox = np.repeat(xs, beams.shape[1])
+        oy = np.repeat(ys, beams.shape[1])
+        ranges = march(
+            ox, oy, beams.ravel(), self.segments, self.cell_offsets, self.cell_edges,
+            nx=self.nx, ny=self.ny, cell_size=self.cell_size, range_=range_
+        )
+        return ranges.reshape(beams.shape)
+
+
+class IndexCaster:
+    # casts beams as segments through the wallmap spatial index, whichever backend it uses
+
+    def __init__(self, wallmap):
+        self.index = wallmap.get_spatial_index()
+        self.segments = wallmap.get_segments()
+        self.width = wallmap.nx * wallmap.grid_size
+        self.height = wallmap.ny * wallmap.grid_size
+
+    def cast_rays(self, xs, ys, angles, *, range_, aperture, num_sensors):
+        return self.cast_beams(xs, ys, sensor_angles(angles, aperture, num_sensors), range_=range_)
+
+    def cast_beams(self, xs, ys, beams, *, range_):
+        ox = np.repeat(np.asarray(xs, dtype=np.float64), beams.shape[1])
+        oy = np.repeat(np.asarray(ys, dtype=np.float64), beams.shape[1])
+        dx = np.cos(beams.ravel())
+        dy = np.sin(beams.ravel())
+
+        ranges = np.full(len(ox), np.inf)
+
+        # a bounded index misses the walls outside the grid, that only origins outside it can see
+        queried = np.arange(len(ox))
+        if self.index.bounded:
+            outside = (ox < 0) | (ox >= self.width) | (oy < 0) | (oy >= self.height)
+            if outside.any():
+                ranges[outside] = cast_beams(
+                    ox[outside], oy[outside], beams.ravel()[outside, None], self.segments, range_=range_)[:, 0]
+                queried = np.flatnonzero(~outside)
+
+        rays, edges = self.index.query_segments(np.column_stack((
+            ox[queried], oy[queried], ox[queried] + range_ * dx[queried], oy[queried] + range_ * dy[queried])))
+        rays = queried[rays]
+        t = _intersect(ox[rays], oy[rays], dx[rays], dy[rays], self.segments[edges])
+        np.minimum.at(ranges, rays, t)
+
+        return np.minimum(ranges, range_).reshape(beams.shape)
+
+
+def march(ox, oy, beams, segments, cell_offsets, cell_edges, *, nx, ny, cell_size, range_):
+    ranges = np.full(len(ox), float(range_))
+    if len(ox) == 0 or len(segments) == 0:
+        return ranges
+
+    dx = np.cos(beams)
+    dy = np.sin(beams)
+
+    ix = np.floor(ox / cell_size).astype(np.intp)
+    iy = np.floor(oy / cell_size).astype(np.intp)
+
+    # origins outside the grid have no cell to start from, cast them exhaustively
+    outside = (ix < 0) | (ix >= nx) | (iy < 0) | (iy >= ny)
+    if outside.any():
+        ranges[outside] = cast_beams(
+            ox[outside], oy[outside], beams[outside, None], segments, range_=range_)[:, 0]
+
+    step_x = np.where(dx > 0, 1, -1)
+    step_y = np.where(dy > 0, 1, -1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_x = np.where(dx != 0, cell_size / np.abs(dx), np.inf)
+        delta_y = np.where(dy != 0, cell_size / np.abs(dy), np.inf)
+        next_x = np.where(dx != 0, ((ix + (dx > 0)) * cell_size - ox) / dx, np.inf)
+        next_y = np.where(dy != 0, ((iy + (dy > 0)) * cell_size - oy) / dy, np.inf)
+
+    active = np.flatnonzero(~outside)
+    while len(active):
+        t_exit = np.minimum(next_x[active], next_y[active])
+
+        cells = iy[active] * nx + ix[active]
+        starts = cell_offsets[cells]
+        counts = cell_offsets[cells + 1] - starts
+
+        total = counts.sum()
+        if total:
+            # expand every active ray into one entry per edge of its current cell
+            pair_ray = np.repeat(np.arange(len(active)), counts)
+            pair_pos = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            pair_edge = cell_edges[np.repeat(starts, counts) + pair_pos]
+
+            rays = active[pair_ray]
+            t = _intersect(ox[rays], oy[rays], dx[rays], dy[rays], segments[pair_edge])
+
+            # only hits inside the current cell are guaranteed to be the first ones
+            limit = np.minimum(t_exit, range_)[pair_ray] + 1e-9
+            valid = t <= limit
+            nearest = np.full(len(active), np.inf)
+            np.minimum.at(nearest, pair_ray[valid], t[valid])
+
+            hit = np.isfinite(nearest)
+            ranges[active[hit]] = np.minimum(nearest[hit], range_)
+        else:
+            hit = np.zeros(len(active), dtype=bool)
+
+        go_x = next_x[active] < next_y[active]
+        moved_x = active[go_x]
+        moved_y = active[~go_x]
+        ix[moved_x] += step_x[moved_x]
+        next_x[moved_x] += delta_x[moved_x]
+        iy[moved_y] += step_y[moved_y]
+        next_y[moved_y] += delta_y[moved_y]
+
+        inside = (ix[active] >= 0) & (ix[active] < nx) & (iy[active] >= 0) & (iy[active] < ny)
+        active = active[~hit & inside & (t_exit < range_)]
+
+    return ranges
+
+
+def _intersect(ox, oy, dx, dy, segments):
+    # distance along each ray to its paired segment, inf when they do not cross
+    ax = segments[:, 0] - ox
+    ay = segments[:, 1] - oy
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+
+    denom = dx * ey - dy * ex
+    parallel = denom == 0
+    denom = np.where(parallel, 1.0, denom)
+
+    t = (ax * ey - ay * ex) / denom
+    u = (ax * dy - ay * dx) / denom
+
+    return np.where(~parallel & (t >= 0) & (u >= 0) & (u <= 1), t, np.inf)
@@ -0,0 +1,162 @@
+# background frame recording
+#
+# capture copies the frame into one of a fixed pool of buffers and returns, a writer
+# thread encodes and writes the frames; when every buffer is waiting to be written
+# capture blocks (or drops the frame), so memory stays bounded by the pool size.
+# the encoding goes through zlib, which releases the GIL while compressing
+#
+#   python recorder.py frames/frames_20240101000000/frames.mcl --png output_directory
+#
+# extracts the frames of a container file as a PNG sequence
+
+import argparse
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pygame
+
+FORMATS = ('png', 'raw', 'zlib')
+
+CONTAINER_MAGIC = b'MCLF'
+CONTAINER_HEADER = struct.Struct('<4sBIIf')
+FRAME_HEADER = struct.Struct('<IQ')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(rgb, level=1):
+    # rgb holds (height, width, 3) bytes, every scanline gets the 'none' filter
+    height, width, _ = rgb.shape
+    scanlines = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rgb.reshape(height, width * 3)
+
+    return b''.join((
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        _png_chunk(b'IDAT', zlib.compress(scanlines.tobytes(), level)),
+        _png_chunk(b'IEND', b''),
+    ))
+
+
+class FrameRecorder:
+
+    def __init__(self, directory, size, *, format='png', fps=24, pool_size=8, block=True, level=1):
+        if format not in FORMATS:
+            raise ValueError(f'Invalid recording format {format}')
+
+        self.directory = directory
+        self.format = format
+        self.block = block
+        self.level = level
+        self.dropped = 0
+
+        width, height = size
+        self.free = queue.Queue()
+        for _ in range(pool_size):
+            self.free.put(np.empty((width, height, 3), dtype=np.uint8))
+        self.pending = queue.Queue()
+
+        self.container = None
+        if format != 'png':
+            self.container = open(os.path.join(directory, 'frames.mcl'), 'wb')
+            self.container.write(CONTAINER_HEADER.pack(
+                CONTAINER_MAGIC, format == 'zlib', width, height, fps))
+
+        self.error = None
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def capture(self, surface, frame_index):
+        if self.error is not None:
+            raise self.error
+
+        try:
+            buffer = self.free.get(block=self.block)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+
+        # pixels3d is a (width, height, 3) view that locks the surface until released
+        pixels = pygame.surfarray.pixels3d(surface)
+        np.copyto(buffer, pixels)
+        del pixels
+
+        self.pending.put((frame_index, buffer))
+        return True
+
+    def write_frames(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            frame_index, buffer = item
+            try:
+                if self.error is None:
+                    self.write_frame(frame_index, np.ascontiguousarray(buffer.transpose(1, 0, 2)))
+            except Exception as e:
+                self.error = e
+            finally:
+                self.free.put(buffer)
+
+    def write_frame(self, frame_index, rgb):
+        if self.format == 'png':
+            path = os.path.join(self.directory, f'{str(frame_index).zfill(8)}.png')
+            with open(path, 'wb') as frame_file:
+                frame_file.write(encode_png(rgb, self.level))
+            return
+
+        data = rgb.tobytes()
+        if self.format == 'zlib':
+            data = zlib.compress(data, self.level)
+        self.container.write(FRAME_HEADER.pack(frame_index, len(data)))
+        self.container.write(data)
+
+    def close(self):
+        # waits for the frames still queued, nothing is lost on a clean exit
+        if self.writer is None:
+            return
+
+        self.pending.put(None)
+        self.writer.join()
+        self.writer = None
+
+        if self.container is not None:
+            self.container.close()
+        if self.error is not None:
+            raise self.error
+
+
+def read_frames(file_path):
+    # yields (frame index, (height, width, 3) frame) from a container file
+    with open(file_path, 'rb') as container:
+        magic, compressed, width, height, _ = CONTAINER_HEADER.unpack(container.read(CONTAINER_HEADER.size))
+        if magic != CONTAINER_MAGIC:
+            raise ValueError(f'Invalid frame container {file_path}')
+
+        while header := container.read(FRAME_HEADER.size):
+            frame_index, length = FRAME_HEADER.unpack(header)
+            data = container.read(length)
+            if compressed:
+                data = zlib.decompress(data)
+            yield frame_index, np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract the frames of a recording container')
+    parser.add_argument('container', type=str,
+                        help='Path to the frames.mcl file')
+    parser.add_argument('--png', type=str, required=True,
+                        help='Directory the PNG sequence is written to')
+    args = parser.parse_args()
+
+    os.makedirs(args.png, exist_ok=True)
+    for frame_index, frame in read_frames(args.container):
+        with open(os.path.join(args.png, f'{str(frame_index).zfill(8)}.png'), 'wb') as frame_file:
+            frame_file.write(encode_png(frame, 6))
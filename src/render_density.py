@@ -0,0 +1,52 @@
+# renders the snapshots of a density store, written by --save_density, as images
+#
+#   python render_density.py density/density_20240101000000 --output density_images
+
+import argparse
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from density_store import DensityReader
+
+
+def render(reader, output_directory, *, upscale=True):
+    os.makedirs(output_directory, exist_ok=True)
+
+    fig, ax = plt.subplots()
+    ax.set_xlabel('')
+    ax.set_ylabel('')
+    ax.set_xticks([])
+    ax.set_yticks([])
+
+    image = None
+    for index, density_map in reader:
+        if upscale and reader.downsample > 1:
+            density_map = density_map.repeat(reader.downsample, axis=0).repeat(reader.downsample, axis=1)
+
+        if image is None:
+            image = ax.imshow(density_map, cmap='hot', interpolation='nearest')
+        else:
+            image.set_data(density_map)
+            image.set_clim(density_map.min(), density_map.max())
+
+        fig.savefig(os.path.join(output_directory, f'{str(index).zfill(8)}.png'), bbox_inches='tight')
+
+    plt.close(fig)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render a density store as PNG images')
+    parser.add_argument('store', type=str,
+                        help='Directory written by --save_density')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Directory of the images, defaults to <store>/images')
+    parser.add_argument('--no_upscale', action='store_true',
+                        help='Keep downsampled snapshots at their stored size')
+    args = parser.parse_args()
+
+    reader = DensityReader(args.store)
+    render(reader, args.output or os.path.join(args.store, 'images'), upscale=not args.no_upscale)
+    print(f'Rendered {len(reader)} density maps')
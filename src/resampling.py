@@ -0,0 +1,163 @@
+import numpy as np
+
+# every resampler takes either a (N,) weight vector or a (K, N) batch of independent
+# weight rows and returns indices of the same leading shape
+
+
+def _normalized_cumsum(weights):
+    cumulative_weights = np.cumsum(weights, axis=-1, dtype=np.float64)
+    return cumulative_weights / cumulative_weights[..., -1:]
+
+
+def _pick(cumulative_weights, positions):
+    num_weights = cumulative_weights.shape[-1]
+    if cumulative_weights.ndim == 1:
+        indices = np.searchsorted(cumulative_weights, positions, side='right')
+        return np.minimum(indices, num_weights - 1)
+
+    # one searchsorted over all rows, every row shifted into its own unit interval
+    offsets = np.arange(len(cumulative_weights))[:, None]
+    indices = np.searchsorted(
+        (cumulative_weights + offsets).ravel(), (positions + offsets).ravel(), side='right')
+    return np.minimum(indices.reshape(positions.shape) - offsets * num_weights, num_weights - 1)
+
+
+def multinomial_resampling(weights, num_samples):
+    weights = np.asarray(weights)
+    positions = np.random.uniform(size=weights.shape[:-1] + (num_samples,))
+    return _pick(_normalized_cumsum(weights), positions)
+
+
+def systematic_resampling(weights, num_samples):
+    # a single random offset shared by evenly spaced positions, the low-variance resampler
+    weights = np.asarray(weights)
+    positions = (np.random.uniform(size=weights.shape[:-1] + (1,)) + np.arange(num_samples)) / num_samples
+    return _pick(_normalized_cumsum(weights), positions)
+
+
+def stratified_resampling(weights, num_samples):
+    weights = np.asarray(weights)
+    positions = (np.random.uniform(size=weights.shape[:-1] + (num_samples,)) + np.arange(num_samples)) / num_samples
+    return _pick(_normalized_cumsum(weights), positions)
+
+
+def residual_resampling(weights, num_samples):
+    # deterministic copies for the integer part of the expected counts,
+    # the remaining samples are drawn from the fractional residuals
+    weights = np.asarray(weights, dtype=np.float64)
+    rows = weights.reshape(-1, weights.shape[-1])
+    num_rows, num_weights = rows.shape
+
+    expected = rows / rows.sum(axis=1, keepdims=True) * num_samples
+    counts = np.floor(expected).astype(np.intp)
+    copies = counts.sum(axis=1)
+
+    # the copies of every row, in order, then written at the start of their row
+    indices = np.empty((num_rows, num_samples), dtype=np.intp)
+    copy_rows = np.repeat(np.arange(num_rows), copies)
+    copy_columns = np.arange(copies.sum()) - np.repeat(np.cumsum(copies) - copies, copies)
+    indices[copy_rows, copy_columns] = np.repeat(np.tile(np.arange(num_weights), num_rows), counts.ravel())
+
+    remaining = num_samples - copies
+    if remaining.any():
+        residuals = expected - counts
+        empty = residuals.sum(axis=1) <= 0
+        residuals[empty] = rows[empty]
+
+        # one draw for all of the rows, each row keeps the first samples it needs
+        draws = multinomial_resampling(residuals, remaining.max())
+        columns = np.arange(num_samples) - copies[:, None]
+        drawn = columns >= 0
+        indices[drawn] = np.take_along_axis(draws, np.maximum(columns, 0), axis=1)[drawn]
+
+    return indices.reshape(weights.shape[:-1] + (num_samples,))
+
+
+RESAMPLERS = {
+    'multinomial': multinomial_resampling,
+    'systematic': systematic_resampling,
+    'stratified': stratified_resampling,
+    'residual': residual_resampling,
+}
+
+
+def get_resampler(name):
+    if name not in RESAMPLERS:
+        raise ValueError(f'Invalid resampler {name}')
+    return RESAMPLERS[name]
+
+
+def kld_bound(num_bins, epsilon, z):
+    # samples needed so that, with probability given by the normal quantile z, the
+    # KL-divergence between the sample and the true posterior stays below epsilon
+    num_bins = np.asarray(num_bins, dtype=np.float64)
+    k = np.maximum(num_bins - 1, 1)
+    a = 2.0 / (9.0 * k)
+    bound = k / (2.0 * epsilon) * (1.0 - a + np.sqrt(a) * z) ** 3
+    return np.where(num_bins > 1, np.ceil(bound), 1)
+
+
+class KLDSampler:
+    # KLD-sampling (Fox, 2003): keeps drawing particles until the number of occupied
+    # pose histogram bins says the sample approximates the posterior well enough
+
+    def __init__(self, *, epsilon=0.05, z=2.33, bin_size=20.0, bin_angle=np.radians(20),
+                 min_particles=50, max_particles=50000, batch_size=256):
+        self.epsilon = epsilon
+        self.z = z
+        self.bin_size = bin_size
+        self.bin_angle = bin_angle
+        self.min_particles = min_particles
+        self.max_particles = max_particles
+        self.batch_size = batch_size
+
+    def bins(self, positions, angles):
+        bx = np.floor(positions[:, 0] / self.bin_size).astype(np.int64)
+        by = np.floor(positions[:, 1] / self.bin_size).astype(np.int64)
+        ba = np.floor((angles % (2 * np.pi)) / self.bin_angle).astype(np.int64)
+        # pack the three bin coordinates in one key, offsets keep negative cells apart
+        return ((bx + (1 << 20)) << 40) | ((by + (1 << 20)) << 16) | ba
+
+    def sample(self, draw, positions=None, angles=None):
+        # draw(n) returns n new (positions, angles), positions and angles are already kept particles
+        occupied = np.empty(0, dtype=np.int64)
+        kept = 0
+        if positions is not None and len(positions):
+            occupied = np.unique(self.bins(positions, angles))
+            kept = len(positions)
+
+        drawn_positions, drawn_angles = [], []
+        drawn = 0
+        batch_size = self.batch_size
+
+        while kept + drawn < self.max_particles:
+            batch_size = min(batch_size, self.max_particles - kept - drawn)
+            batch_positions, batch_angles = draw(batch_size)
+            keys = self.bins(batch_positions, batch_angles)
+
+            # number of occupied bins after each sample of the batch
+            _, first = np.unique(keys, return_index=True)
+            new_bin = np.zeros(batch_size, dtype=bool)
+            new_bin[first] = True
+            new_bin &= ~np.isin(keys, occupied)
+            num_bins = len(occupied) + np.cumsum(new_bin)
+
+            counts = kept + drawn + np.arange(1, batch_size + 1)
+            done = (counts >= kld_bound(num_bins, self.epsilon, self.z)) & (counts >= self.min_particles)
+
+            if done.any():
+                stop = np.argmax(done) + 1
+                drawn_positions.append(batch_positions[:stop])
+                drawn_angles.append(batch_angles[:stop])
+                drawn += stop
+                break
+
+            drawn_positions.append(batch_positions)
+            drawn_angles.append(batch_angles)
+            drawn += batch_size
+            occupied = np.union1d(occupied, keys)
+            batch_size *= 2
+
+        if not drawn_positions:
+            return np.empty((0, 2)), np.empty(0)
+        return np.concatenate(drawn_positions), np.concatenate(drawn_angles)
@@ -1,3 +1,4 @@
+import functools
 import itertools
 import math
 import random
@@ -5,8 +6,8 @@ import random
 import numpy as np
 import pygame
 
-import geometry_utils
-from sklearn.metrics.pairwise import cosine_similarity
+import kernels
+import raycast
 
 SIGMA_MOVE = .5
 SIGMA_ROTATE = math.radians(.3)
@@ -90,40 +91,37 @@ class Particle:
             for angle, distance in zip(angles, distances)
         )
 
-    def measure(self, walls, *, grid_size=20):
-        measurements = []
-        for sample in self.compute_sensor_points():
-            intersections = (
-                geometry_utils.line_line_intersection(
-                    (wall.pos1 * grid_size, wall.pos2 *
-                     grid_size), (self.position, sample)
-                ) for wall in walls
-            )
-            distances = (
-                math.dist(self.position, point)
-                for point in intersections if point is not None
-            )
-
-            measure = min(min(distances, default=self.range_), self.range_)
-            noise = random.gauss(0.0, SIGMA_MEASURE)
-            measurements.append(measure + noise)
-
-        return measurements
-
-    def update(self, walls, *, grid_size=20):
-        self.measurements = self.measure(walls, grid_size=grid_size)
+    def measure(self, walls, *, grid_size=20, caster=None):
+        x, y = self.position
+        sensor_params = {'range_': self.range_, 'aperture': self.aperture, 'num_sensors': self.num_sensors}
+
+        if caster is not None:
+            ranges = caster.cast_rays((x,), (y,), (self.angle,), **sensor_params)[0]
+        else:
+            ranges = raycast.cast_rays(
+                (x,), (y,), (self.angle,), raycast.as_segments(walls, grid_size), **sensor_params)[0]
+
+        return ranges + np.random.normal(0.0, SIGMA_MEASURE, size=self.num_sensors)
+
+    def update(self, walls, *, grid_size=20, caster=None):
+        self.measurements = self.measure(walls, grid_size=grid_size, caster=caster)
         return self.measurements
 
     @staticmethod
     def draw_robot(screen, robot, *, color=(0, 0, 0), draw_lasers=False, draw_laser_outlines=False):
-        x, y = robot.position
-        pygame.draw.circle(screen, color, (x, y), robot.radius)
+        Particle.draw_pose(
+            screen, robot.position, robot.angle, robot.radius,
+            tuple(robot.compute_sensor_points(robot.measurements)),
+            color=color, draw_lasers=draw_lasers, draw_laser_outlines=draw_laser_outlines)
 
-        xr, yr = x + robot.radius * \
-            math.cos(robot.angle), y + robot.radius * math.sin(robot.angle)
-        pygame.draw.line(screen, (255, 0, 0), (x, y), (xr, yr), 3)
+    @staticmethod
+    def draw_pose(screen, position, angle, radius, points, *,
+                  color=(0, 0, 0), draw_lasers=False, draw_laser_outlines=False):
+        x, y = position
+        pygame.draw.circle(screen, color, (x, y), radius)
 
-        points = tuple(robot.compute_sensor_points(robot.measurements))
+        xr, yr = x + radius * math.cos(angle), y + radius * math.sin(angle)
+        pygame.draw.line(screen, (255, 0, 0), (x, y), (xr, yr), 3)
 
         if draw_lasers:
             for point in points:
@@ -132,16 +130,6 @@ class Particle:
         if draw_laser_outlines:
             pygame.draw.lines(screen, (0, 255, 0), False, points, 3)
 
-    @staticmethod
-    def draw_particle(screen, particle):
-        x, y = particle.position
-        pygame.draw.circle(screen, (0, 0, 255), (x, y), particle.radius)
-
-        xr, yr = x + particle.radius * \
-            math.cos(particle.angle), y + particle.radius * \
-            math.sin(particle.angle)
-        pygame.draw.line(screen, (0, 255, 255), (x, y), (xr, yr), 3)
-
     def draw(self, screen, *, draw_sensor_ranges=False, draw_measurements=False):
         x, y = self.position
         pygame.draw.circle(screen, (0, 0, 0), (x, y), Particle.RADIUS)
@@ -169,3 +157,201 @@ class Particle:
             for i in range(0, len(points)-1):
                 pygame.draw.line(screen, (0, 255, 0),
                                  points[i], points[i+1], 3)
+
+
+class ParticleSet:
+    # structure of arrays holding every particle pose and its latest measurements,
+    # so that motion, scoring and selection run on whole arrays at once
+
+    def __init__(self, xs, ys, angles, *,
+                 range_=50.0, aperture=math.pi/4.0, num_sensors=5, measurements=None):
+
+        self.xs = np.array(xs, dtype=np.float64)
+        self.ys = np.array(ys, dtype=np.float64)
+        self.angles = np.array(angles, dtype=np.float64)
+
+        self.radius = Particle.PARTICLE_SIZE
+
+        self.range_ = range_
+        self.aperture = aperture
+        self.num_sensors = num_sensors
+
+        if measurements is None:
+            measurements = np.full((len(self.xs), self.num_sensors), float(self.range_))
+        self.measurements = np.array(measurements, dtype=np.float64)
+
+    @classmethod
+    def uniform(cls, num_particles, width, height, **kwargs):
+        return cls(
+            np.random.uniform(0, width, size=num_particles),
+            np.random.uniform(0, height, size=num_particles),
+            np.random.uniform(0, 2 * math.pi, size=num_particles),
+            **kwargs
+        )
+
+    @classmethod
+    def from_poses(cls, positions, angles, **kwargs):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        return cls(positions[:, 0], positions[:, 1], angles, **kwargs)
+
+    @staticmethod
+    def concatenate(particle_sets):
+        first = particle_sets[0]
+        return ParticleSet(
+            np.concatenate([s.xs for s in particle_sets]),
+            np.concatenate([s.ys for s in particle_sets]),
+            np.concatenate([s.angles for s in particle_sets]),
+            measurements=np.concatenate([s.measurements for s in particle_sets]),
+            **first.sensor_params()
+        )
+
+    def __len__(self):
+        return len(self.xs)
+
+    def sensor_params(self):
+        return {
+            'range_': self.range_,
+            'aperture': self.aperture,
+            'num_sensors': self.num_sensors
+        }
+
+    def get_positions(self):
+        return np.column_stack((self.xs, self.ys))
+
+    def get_angles(self):
+        return self.angles
+
+    def get_radius(self):
+        return self.radius
+
+    def particle(self, index):
+        p = Particle(
+            (self.xs[index], self.ys[index]), self.angles[index],
+            type='particle', **self.sensor_params()
+        )
+        p.measurements = self.measurements[index]
+        return p
+
+    def measure(self, walls, *, grid_size=20, caster=None):
+        # caster is any object exposing cast_rays, e.g. a RangeTable or a GridMarcher
+        sensor_params = self.sensor_params()
+
+        if caster is not None:
+            ranges = caster.cast_rays(self.xs, self.ys, self.angles, **sensor_params)
+        else:
+            ranges = raycast.cast_rays(
+                self.xs, self.ys, self.angles, raycast.as_segments(walls, grid_size), **sensor_params)
+
+        return ranges + np.random.normal(0.0, SIGMA_MEASURE, size=ranges.shape)
+
+    def update(self, walls, *, grid_size=20, caster=None):
+        self.measurements = self.measure(walls, grid_size=grid_size, caster=caster)
+        return self.measurements
+
+    def select(self, indices):
+        return ParticleSet(
+            self.xs[indices], self.ys[indices], self.angles[indices],
+            measurements=self.measurements[indices],
+            **self.sensor_params()
+        )
+
+    def likelihood(self, ground_thruth):
+        max_dist = self.range_ * self.num_sensors
+        if kernels.use_numba():
+            return kernels.likelihood(self.measurements, ground_thruth, max_dist)
+
+        dists = np.abs(self.measurements - np.asarray(ground_thruth)).sum(axis=1)
+        return (max_dist - dists) / max_dist
+
+    def rotate(self, angle, *, noise=None):
+        noise = np.random.normal(0, SIGMA_ROTATE, size=len(self)) if noise is None else noise
+        self.angles += angle + noise
+
+        return (self.angles, noise)
+
+    def move(self, speed, *, noise=None):
+        noise = np.random.normal(0, SIGMA_MOVE, size=len(self)) if noise is None else noise
+        speed = speed + noise
+
+        positions = np.empty((len(self), 2))
+        positions[:, 0] = self.xs + speed * np.cos(self.angles)
+        positions[:, 1] = self.ys + speed * np.sin(self.angles)
+
+        return (positions, noise)
+
+    def apply_move(self, positions):
+        self.xs[:] = positions[:, 0]
+        self.ys[:] = positions[:, 1]
+
+    @staticmethod
+    def draw_particles(screen, particles, *, heatmap_threshold=2000):
+        # every disc and heading stamp is written into the screen pixels at once,
+        # past heatmap_threshold particles the density is drawn instead
+        if len(particles) > heatmap_threshold:
+            ParticleSet.draw_heatmap(screen, particles)
+            return
+
+        disc = _disc_offsets(particles.radius)
+        headings = _heading_offsets(particles.radius)
+        heading_bins = np.rint(particles.angles % (2 * math.pi) / (2 * math.pi) * len(headings)).astype(np.intp)
+
+        pixels = pygame.surfarray.pixels2d(screen)
+        _stamp(pixels, particles.xs, particles.ys, disc, screen.map_rgb((0, 0, 255)))
+        _stamp(pixels, particles.xs, particles.ys, headings[heading_bins % len(headings)], screen.map_rgb((0, 255, 255)))
+        del pixels
+
+    @staticmethod
+    def draw_heatmap(screen, particles, *, cell=4, color=(0, 0, 255)):
+        width, height = screen.get_size()
+        nx, ny = -(-width // cell), -(-height // cell)
+
+        cx = np.clip((particles.xs // cell).astype(np.intp), 0, nx - 1)
+        cy = np.clip((particles.ys // cell).astype(np.intp), 0, ny - 1)
+        counts = np.bincount(cx * ny + cy, minlength=nx * ny).reshape(nx, ny)
+
+        layer = pygame.Surface((nx, ny), pygame.SRCALPHA)
+        layer.fill(color)
+        alpha = pygame.surfarray.pixels_alpha(layer)
+        alpha[...] = np.sqrt(counts / max(counts.max(), 1)) * 255
+        del alpha
+
+        screen.blit(pygame.transform.scale(layer, (nx * cell, ny * cell)), (0, 0))
+
+
+@functools.lru_cache(maxsize=8)
+def _disc_offsets(radius):
+    r = int(math.ceil(radius))
+    dx, dy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1))
+    inside = dx * dx + dy * dy <= radius * radius
+    return np.column_stack((dx[inside], dy[inside]))
+
+
+@functools.lru_cache(maxsize=8)
+def _heading_offsets(radius, num_headings=64):
+    # pixels of a 3 pixel wide line from the center to the border of the disc, for evenly
+    # spaced headings; shorter stamps repeat their first pixel so they stack in one array
+    steps = np.linspace(0, radius, max(int(radius) + 1, 2))
+    pen = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+    stamps = []
+    for angle in np.linspace(0, 2 * math.pi, num_headings, endpoint=False):
+        line = np.rint(np.column_stack((steps * math.cos(angle), steps * math.sin(angle)))).astype(np.intp)
+        stamps.append(np.unique((line[:, None, :] + pen).reshape(-1, 2), axis=0))
+
+    size = max(len(stamp) for stamp in stamps)
+    return np.stack([np.concatenate((stamp, np.repeat(stamp[:1], size - len(stamp), axis=0))) for stamp in stamps])
+
+
+def _stamp(pixels, xs, ys, offsets, color):
+    # pixels is the (width, height) view of a surface and color a mapped pixel value,
+    # offsets is either one (K, 2) stamp for all of the points or a (N, K, 2) stamp per point;
+    # the stamps are written through the flat, row major, index of every pixel
+    width, height = pixels.shape
+    px = np.rint(xs).astype(np.intp)[:, None] + offsets[..., 0]
+    py = np.rint(ys).astype(np.intp)[:, None] + offsets[..., 1]
+    inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+    flat = pixels.T.reshape(-1) if pixels.T.flags.c_contiguous else None
+    if flat is None:
+        pixels[px[inside], py[inside]] = color
+    else:
+        flat[py[inside] * width + px[inside]] = color
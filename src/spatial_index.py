@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+
+import wallmap as wallmap_module
+
+
+def _unique_pairs(query_ids, edge_ids, num_edges):
+    keys = np.sort(query_ids * num_edges + edge_ids)
+    keys = keys[np.diff(keys, prepend=-1) != 0]
+    return keys // num_edges, keys % num_edges
+
+
+def _segments_intersect(a, b):
+    # closed segment intersection test between matching rows of two (N, 4) arrays
+    def orientation(px, py, qx, qy, rx, ry):
+        return np.sign((qx - px) * (ry - py) - (qy - py) * (rx - px))
+
+    def on_segment(px, py, qx, qy, rx, ry):
+        return (np.minimum(px, qx) <= rx) & (rx <= np.maximum(px, qx)) & \
+            (np.minimum(py, qy) <= ry) & (ry <= np.maximum(py, qy))
+
+    ax, ay, bx, by = a.T
+    cx, cy, dx, dy = b.T
+
+    o1 = orientation(ax, ay, bx, by, cx, cy)
+    o2 = orientation(ax, ay, bx, by, dx, dy)
+    o3 = orientation(cx, cy, dx, dy, ax, ay)
+    o4 = orientation(cx, cy, dx, dy, bx, by)
+
+    return ((o1 != o2) & (o3 != o4)) | \
+        ((o1 == 0) & on_segment(ax, ay, bx, by, cx, cy)) | \
+        ((o2 == 0) & on_segment(ax, ay, bx, by, dx, dy)) | \
+        ((o3 == 0) & on_segment(cx, cy, dx, dy, ax, ay)) | \
+        ((o4 == 0) & on_segment(cx, cy, dx, dy, bx, by))
+
+
+def _point_segment_distance(points, segments):
+    ax, ay = segments[:, 0], segments[:, 1]
+    ex, ey = segments[:, 2] - ax, segments[:, 3] - ay
+    px, py = points[:, 0] - ax, points[:, 1] - ay
+
+    u = np.clip((px * ex + py * ey) / np.maximum(ex * ex + ey * ey, 1e-12), 0.0, 1.0)
+    return np.hypot(px - u * ex, py - u * ey)
+
+
+def _clip_segments(segments, width, height):
+    # Liang-Barsky clipping of (N, 4) segments to the box [0, width] x [0, height],
+    # returns the clipped segments and the mask of the segments crossing the box at all
+    x0, y0 = segments[:, 0], segments[:, 1]
+    dx, dy = segments[:, 2] - x0, segments[:, 3] - y0
+
+    t0 = np.zeros(len(segments))
+    t1 = np.ones(len(segments))
+    inside = np.ones(len(segments), dtype=bool)
+    for p, q in ((-dx, x0), (dx, width - x0), (-dy, y0), (dy, height - y0)):
+        parallel = p == 0
+        inside &= ~(parallel & (q < 0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = np.where(parallel, 0.0, q / np.where(parallel, 1.0, p))
+        t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+        t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    inside &= t0 <= t1
+
+    clipped = np.column_stack((x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy))
+    return clipped, inside
+
+
+class GridIndex:
+    # answers queries from the wallmap uniform tile index, so walls lying outside
+    # the map area are never reported
+    bounded = True
+
+    def __init__(self, wallmap):
+        self.wallmap = wallmap
+        self.edge_table = wallmap.get_segments()
+
+    def query_segments(self, segments):
+        # pairs (query id, edge id) of every query segment in pixels crossing a wall
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        wm = self.wallmap
+
+        # only the part of the queries inside the grid can reach an indexed cell
+        clipped, inside = _clip_segments(segments / wm.grid_size, wm.nx, wm.ny)
+        inside_ids = np.flatnonzero(inside)
+        query_ids, cells = wallmap_module.supercover_cells(clipped[inside], wm.nx, wm.ny)
+        query_ids = inside_ids[query_ids]
+        counts = wm.cell_offsets[cells + 1] - wm.cell_offsets[cells]
+        edge_ids = wm.cells_edge_ids(cells)
+        query_ids, edge_ids = _unique_pairs(
+            np.repeat(query_ids, counts), edge_ids, max(len(self.edge_table), 1))
+
+        hits = _segments_intersect(segments[query_ids], self.edge_table[edge_ids])
+        return query_ids[hits], edge_ids[hits]
+
+    def query_circles(self, centers, radius):
+        # pairs (query id, edge id) of every wall within radius of the query centers
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        wm = self.wallmap
+
+        span = math.ceil(2 * radius / wm.grid_size) + 1
+        offsets = np.arange(span)
+        x0 = np.floor((centers[:, 0] - radius) / wm.grid_size).astype(np.intp)
+        y0 = np.floor((centers[:, 1] - radius) / wm.grid_size).astype(np.intp)
+
+        xs = (x0[:, None, None] + offsets[None, :, None]).repeat(span, axis=2).ravel()
+        ys = (y0[:, None, None] + offsets[None, None, :]).repeat(span, axis=1).ravel()
+        query_ids = np.repeat(np.arange(len(centers)), span * span)
+
+        inside = (xs >= 0) & (xs < wm.nx) & (ys >= 0) & (ys < wm.ny)
+        cells = ys[inside] * wm.nx + xs[inside]
+        counts = wm.cell_offsets[cells + 1] - wm.cell_offsets[cells]
+        edge_ids = wm.cells_edge_ids(cells)
+        query_ids, edge_ids = _unique_pairs(
+            np.repeat(query_ids[inside], counts), edge_ids, max(len(self.edge_table), 1))
+
+        near = _point_segment_distance(centers[query_ids], self.edge_table[edge_ids]) <= radius
+        return query_ids[near], edge_ids[near]
+
+
+class STRtreeIndex:
+    # bounding-volume hierarchy over the wall segments, better suited than the uniform
+    # grid for long walls or very uneven edge densities
+    bounded = False
+
+    def __init__(self, wallmap):
+        try:
+            import shapely
+            shapely.STRtree
+        except (ImportError, AttributeError):
+            raise ImportError('The strtree spatial index requires shapely >= 2.0')
+
+        self.shapely = shapely
+        self.edge_table = wallmap.get_segments()
+        self.tree = shapely.STRtree(shapely.linestrings(self.edge_table.reshape(-1, 2, 2)))
+
+    def query_segments(self, segments):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        lines = self.shapely.linestrings(segments.reshape(-1, 2, 2))
+        query_ids, edge_ids = self.tree.query(lines, predicate='intersects')
+        return query_ids, edge_ids
+
+    def query_circles(self, centers, radius):
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        points = self.shapely.points(centers)
+        query_ids, edge_ids = self.tree.query(points, predicate='dwithin', distance=radius)
+        return query_ids, edge_ids
+
+
+SPATIAL_INDEXES = {
+    'grid': GridIndex,
+    'strtree': STRtreeIndex,
+}
+
+
+def create_spatial_index(wallmap, backend):
+    if backend not in SPATIAL_INDEXES:
+        raise ValueError(f'Invalid spatial index backend {backend}')
+    return SPATIAL_INDEXES[backend](wallmap)
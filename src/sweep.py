@@ -0,0 +1,249 @@
+# parameter sweeps of headless episodes over a process pool
+#
+#   python sweep.py --sim_settings SimSettings1 --grid num_sensors=8,20 sensor_range=300,450 \
+#       --seeds 5 --steps 1000 --output sweep.csv
+#
+# every (parameter combination, seed) pair is one run, stored as a row of the output file
+# as soon as it finishes; rerunning the same command skips the runs already done in the file
+# and retries the ones that failed or timed out
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import signal
+import statistics
+import sys
+
+import numpy as np
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import main
+from trajectory import load_trajectory
+
+# parameters that can be swept, with the parser of their grid values;
+# the aperture is given in degrees like in config.ini
+SWEEP_PARAMETERS = {
+    'sensor_range': int,
+    'sensor_aperture': lambda value: math.radians(float(value)),
+    'num_sensors': int,
+    'samples': int,
+    'gen_interval': int,
+}
+
+RESULT_FIELDS = (
+    'run_id', 'seed', 'status', 'steps', 'seconds', 'steps_per_second',
+    'convergence_step', 'convergence_seconds', 'position_error', 'heading_error', 'particles',
+)
+
+
+class RunTimeout(Exception):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise RunTimeout()
+
+
+def parse_grid(specs):
+    # name=v1,v2,... per spec, the raw strings are kept for the results file
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in SWEEP_PARAMETERS or not values:
+            raise ValueError(f'Invalid sweep parameter {spec}')
+        grid[name] = values.split(',')
+    return grid
+
+
+def settings_key(settings, sim_settings):
+    # everything a run depends on besides its swept parameters and seed: the settings section,
+    # the config values it reads, the trajectory, the steps and the convergence threshold
+    config_hash = hashlib.sha1(json.dumps(settings['config_data'], sort_keys=True).encode()).hexdigest()
+    trajectory_hash = hashlib.sha1(repr(list(settings['commands'])).encode()).hexdigest()
+    return (f"sim_settings={sim_settings};config={config_hash};trajectory={trajectory_hash};"
+            f"steps={settings['steps']};converged_error={settings['converged_error']}")
+
+
+def expand_runs(grid, seeds, base_seed, base_key=''):
+    # base_key is hashed into every run id, so that runs of other settings are never resumed
+    names = sorted(grid)
+    runs = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(zip(names, values))
+        for repeat in range(seeds):
+            seed = base_seed + repeat
+            key = base_key + ';' + ';'.join(f'{name}={value}' for name, value in params.items()) + f';seed={seed}'
+            runs.append((hashlib.sha1(key.encode()).hexdigest()[:12], params, seed))
+    return runs
+
+
+def run_episode(task):
+    run_id, params, seed, settings = task
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    config_data = dict(settings['config_data'])
+    for name, value in params.items():
+        config_data[name] = SWEEP_PARAMETERS[name](value)
+    # pool workers are daemonic and cannot start the pool of a ParallelCaster
+    config_data['parallel_workers'] = 0
+
+    row = {'run_id': run_id, 'seed': seed, **params}
+
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, settings['timeout'])
+        game = main.Game(config_data, headless=True)
+        result = game.run_headless(
+            settings['commands'], steps=settings['steps'], converged_error=settings['converged_error'])
+        row.update(result, status='ok')
+    except RunTimeout:
+        row['status'] = 'timeout'
+    except Exception as e:
+        row['status'] = f'error: {e}'
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+    return row
+
+
+def read_results(file_path):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, newline='') as results_file:
+        return list(csv.DictReader(results_file))
+
+
+def latest_results(rows):
+    # a failed run is retried by appending a new row, only its last row counts
+    return list({row['run_id']: row for row in rows}.values())
+
+
+def run_sweep(runs, settings, output, fieldnames, *, workers=None):
+    # timed out and failed runs are retried, e.g. after raising --timeout
+    done = {row['run_id'] for row in read_results(output) if row['status'] == 'ok'}
+    pending = [(run_id, params, seed, settings) for run_id, params, seed in runs if run_id not in done]
+    print(f'{len(runs)} runs, {len(runs) - len(pending)} already in {output}, {len(pending)} to go')
+
+    write_header = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, 'a', newline='') as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=fieldnames, extrasaction='ignore')
+        if write_header:
+            writer.writeheader()
+
+        # like ParallelCaster, a fork server keeps the workers from inheriting running threads
+        with multiprocessing.get_context('forkserver').Pool(workers) as pool:
+            try:
+                for i, row in enumerate(pool.imap_unordered(run_episode, pending), start=1):
+                    writer.writerow(row)
+                    results_file.flush()
+                    print(f"[{i}/{len(pending)}] {row['run_id']} {row['status']}")
+            except KeyboardInterrupt:
+                pool.terminate()
+                print('\nInterrupted, rerun the same command to resume')
+                sys.exit(1)
+
+
+def _mean(values):
+    return statistics.fmean(values) if values else float('nan')
+
+
+def summarize(rows, names):
+    # one line per parameter combination, aggregated over its seeds
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[name] for name in names), []).append(row)
+
+    summary = []
+    for key, group in sorted(groups.items()):
+        ok = [row for row in group if row['status'] == 'ok']
+        converged = [float(row['convergence_step']) for row in ok if row['convergence_step']]
+        summary.append({
+            **dict(zip(names, key)),
+            'runs': len(group),
+            'failed': len(group) - len(ok),
+            'converged': len(converged),
+            'convergence_step': statistics.median(converged) if converged else float('nan'),
+            'position_error': _mean([float(row['position_error']) for row in ok]),
+            'heading_error': _mean([float(row['heading_error']) for row in ok]),
+            'steps_per_second': _mean([float(row['steps_per_second']) for row in ok]),
+        })
+    return summary
+
+
+def print_summary(summary):
+    if not summary:
+        return
+    fields = list(summary[0])
+    cells = [[f'{value:.2f}' if isinstance(value, float) else str(value) for value in line.values()]
+             for line in summary]
+    widths = [max(len(field), *(len(row[i]) for row in cells)) for i, field in enumerate(fields)]
+
+    print('  '.join(field.rjust(width) for field, width in zip(fields, widths)))
+    for row in cells:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep simulation settings over headless runs')
+    parser.add_argument('--config', type=str, default='config.ini',
+                        help='Path to the config file')
+    parser.add_argument('--sim_settings', type=str, default='SimulationSettings',
+                        help='Name of the simulation settings the sweep starts from')
+    parser.add_argument('--grid', type=str, nargs='+', required=True,
+                        help=f"Swept values as name=v1,v2,... for any of {', '.join(SWEEP_PARAMETERS)}")
+    parser.add_argument('--seeds', type=int, default=3,
+                        help='Runs per parameter combination, each with its own seed')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the first run of every combination')
+    parser.add_argument('--trajectory', type=str, default=None,
+                        help='Path to a trajectory file, defaults to a built-in path')
+    parser.add_argument('--steps', type=int, default=None,
+                        help='Steps per run, the trajectory is repeated as needed')
+    parser.add_argument('--converged_error', type=float, default=20.0,
+                        help='Position error in pixels under which a run counts as converged')
+    parser.add_argument('--timeout', type=float, default=300.0,
+                        help='Seconds after which a run is stopped and recorded as a timeout')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the number of cores')
+    parser.add_argument('--output', type=str, default='sweep.csv',
+                        help='Per run results, also used to resume an interrupted sweep')
+    parser.add_argument('--summary', type=str, default=None,
+                        help='Path of a CSV file for the aggregated results table')
+    args = parser.parse_args()
+
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+
+    settings = {
+        'config_data': main.read_config(args.config, args.sim_settings),
+        'commands': load_trajectory(args.trajectory),
+        'steps': args.steps,
+        'converged_error': args.converged_error,
+        'timeout': args.timeout,
+    }
+    names = sorted(grid)
+    runs = expand_runs(grid, args.seeds, args.seed, settings_key(settings, args.sim_settings))
+    run_sweep(runs, settings, args.output,
+              list(RESULT_FIELDS[:2]) + names + list(RESULT_FIELDS[2:]), workers=args.workers)
+
+    # the output file may hold other sweeps too, only this grid is summarized
+    run_ids = {run_id for run_id, _, _ in runs}
+    summary = summarize([row for row in latest_results(read_results(args.output)) if row['run_id'] in run_ids], names)
+    print_summary(summary)
+
+    if args.summary and summary:
+        with open(args.summary, 'w', newline='') as summary_file:
+            writer = csv.DictWriter(summary_file, fieldnames=list(summary[0]))
+            writer.writeheader()
+            writer.writerows(summary)
@@ -0,0 +1,120 @@
+# typed metrics recorded into a preallocated columnar buffer
+#
+# with a file, the buffer is appended to it in batches whenever it fills up and on close;
+# without one it is a ring that keeps the latest rows. the file holds a JSON schema
+# followed by batches, each batch stores every column contiguously
+#
+#   python telemetry.py stats/simulation_statistics20240101000000.mclt --csv stats.csv
+#
+# exports a telemetry file as CSV
+
+import argparse
+import csv
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'MCLT'
+BATCH_HEADER = struct.Struct('<I')
+
+
+class Telemetry:
+
+    def __init__(self, columns, path=None, *, capacity=1024):
+        # columns maps every column name to its dtype, unset columns are nan, or -1 for integers
+        self.dtype = np.dtype([(name, dtype) for name, dtype in columns.items()])
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=self.dtype)
+        self.blank = np.zeros((), dtype=self.dtype)
+        for name in self.dtype.names:
+            self.blank[name] = np.nan if self.dtype[name].kind == 'f' else -1
+
+        self.size = 0
+        self.total = 0
+
+        self.file = None
+        if path is not None:
+            self.file = open(path, 'wb')
+            schema = json.dumps([[name, self.dtype[name].str] for name in self.dtype.names]).encode()
+            self.file.write(MAGIC + struct.pack('<I', len(schema)) + schema)
+
+    def __len__(self):
+        return self.total
+
+    def record(self, **values):
+        if self.size == self.capacity:
+            if self.file is not None:
+                self.flush()
+            else:
+                self.size = 0
+
+        self.buffer[self.size] = self.blank
+        row = self.buffer[self.size]
+        for name, value in values.items():
+            row[name] = value
+
+        self.size += 1
+        self.total += 1
+
+    def rows(self):
+        # the rows still held by the buffer, oldest first
+        if self.file is None and self.total > self.capacity:
+            return np.concatenate((self.buffer[self.size:], self.buffer[:self.size]))
+        return self.buffer[:self.size].copy()
+
+    def flush(self):
+        if self.file is None or self.size == 0:
+            return
+
+        rows = self.buffer[:self.size]
+        self.file.write(BATCH_HEADER.pack(self.size))
+        for name in self.dtype.names:
+            self.file.write(np.ascontiguousarray(rows[name]).tobytes())
+        self.file.flush()
+        self.size = 0
+
+    def close(self):
+        if self.file is None:
+            return
+
+        self.flush()
+        self.file.close()
+        self.file = None
+
+
+def read_telemetry(path):
+    # every column of a telemetry file as one array
+    with open(path, 'rb') as telemetry_file:
+        magic, schema_size = struct.unpack('<4sI', telemetry_file.read(8))
+        if magic != MAGIC:
+            raise ValueError(f'Invalid telemetry file {path}')
+        columns = [(name, np.dtype(dtype)) for name, dtype in json.loads(telemetry_file.read(schema_size))]
+
+        batches = {name: [] for name, _ in columns}
+        while header := telemetry_file.read(BATCH_HEADER.size):
+            (num_rows,) = BATCH_HEADER.unpack(header)
+            for name, dtype in columns:
+                batches[name].append(np.frombuffer(telemetry_file.read(num_rows * dtype.itemsize), dtype=dtype))
+
+    return {name: np.concatenate(batches[name]) if batches[name] else np.empty(0, dtype=dtype)
+            for name, dtype in columns}
+
+
+def export_csv(path, csv_path):
+    columns = read_telemetry(path)
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        writer.writerows(zip(*(column.tolist() for column in columns.values())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a telemetry file')
+    parser.add_argument('telemetry', type=str,
+                        help='Path to the .mclt telemetry file')
+    parser.add_argument('--csv', type=str, required=True,
+                        help='Path of the CSV file')
+    args = parser.parse_args()
+
+    export_csv(args.telemetry, args.csv)
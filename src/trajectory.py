@@ -0,0 +1,58 @@
+# scripted robot commands for headless runs
+#
+# a trajectory file holds one command per line, blank lines and '#' comments are skipped:
+#   move <speed> [repeat]
+#   rotate <degrees> [repeat]
+#   step <speed> <degrees> [repeat]
+#   wait [repeat]
+# every command expands into one (speed, rotation in degrees) pair per simulation step
+
+DEFAULT_TRAJECTORY = """
+move 3 40
+rotate 5 18
+move 3 30
+rotate -5 18
+move 3 40
+step 3 5 36
+wait 8
+rotate -5 36
+move 3 40
+"""
+
+
+def parse_trajectory(text):
+    commands = []
+
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+
+        name, *args = line.split()
+        arity = {'move': 1, 'rotate': 1, 'step': 2, 'wait': 0}.get(name)
+        if arity is None or len(args) not in (arity, arity + 1):
+            raise ValueError(f'Invalid trajectory command on line {line_number}: {line}')
+
+        values = [float(arg) for arg in args[:arity]]
+        repeat = int(args[arity]) if len(args) > arity else 1
+
+        if name == 'move':
+            command = (values[0], 0.0)
+        elif name == 'rotate':
+            command = (0.0, values[0])
+        elif name == 'step':
+            command = (values[0], values[1])
+        else:
+            command = (0.0, 0.0)
+
+        commands.extend([command] * repeat)
+
+    return commands
+
+
+def load_trajectory(file_path=None):
+    if file_path is None:
+        return parse_trajectory(DEFAULT_TRAJECTORY)
+
+    with open(file_path) as trajectory_file:
+        return parse_trajectory(trajectory_file.read())
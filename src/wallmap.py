@@ -6,6 +6,8 @@ import pygame
 from shapely.geometry import Polygon
 
 import geometry_utils
+import kernels
+import spatial_index
 from consts import *
 
 
@@ -24,6 +26,57 @@ class Edge:
         self.obstacles.append(obstacle)
 
 
+def supercover_cells(segments, nx, ny):
+    # every grid cell touched by each segment, segments given as (E, 4) in grid units
+    # returns matching arrays of segment ids and cell ids (y * nx + x), clipped to the grid
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    x0, y0, x1, y1 = segments.T
+    dx, dy = x1 - x0, y1 - y0
+
+    # parameters where the segment crosses a vertical or horizontal grid line
+    first_x = np.ceil(np.minimum(x0, x1))
+    first_y = np.ceil(np.minimum(y0, y1))
+    count_x = np.where(dx != 0, np.floor(np.maximum(x0, x1)) - first_x + 1, 0).astype(np.intp)
+    count_y = np.where(dy != 0, np.floor(np.maximum(y0, y1)) - first_y + 1, 0).astype(np.intp)
+
+    def crossings(first, count, origin, delta):
+        ids = np.repeat(np.arange(len(segments)), count)
+        steps = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        return ids, (first[ids] + steps - origin[ids]) / delta[ids]
+
+    ids_x, t_x = crossings(first_x, count_x, x0, dx)
+    ids_y, t_y = crossings(first_y, count_y, y0, dy)
+
+    seg_ids = np.concatenate((np.arange(len(segments)), np.arange(len(segments)), ids_x, ids_y))
+    ts = np.concatenate((np.zeros(len(segments)), np.ones(len(segments)), t_x, t_y))
+
+    # sample the crossings themselves and the midpoints between consecutive crossings,
+    # which covers every cell the segment passes through
+    order = np.lexsort((ts, seg_ids))
+    seg_ids, ts = seg_ids[order], ts[order]
+    same = seg_ids[1:] == seg_ids[:-1]
+    seg_ids = np.concatenate((seg_ids, seg_ids[1:][same]))
+    ts = np.concatenate((ts, ((ts[1:] + ts[:-1]) / 2)[same]))
+
+    px = x0[seg_ids] + ts * dx[seg_ids]
+    py = y0[seg_ids] + ts * dy[seg_ids]
+
+    # points lying on grid lines touch the cells on both sides
+    eps = 1e-9
+    cell_ids, cells = [], []
+    for ox in (-eps, eps):
+        for oy in (-eps, eps):
+            cx = np.floor(px + ox).astype(np.intp)
+            cy = np.floor(py + oy).astype(np.intp)
+            inside = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+            cell_ids.append(seg_ids[inside])
+            cells.append(cy[inside] * nx + cx[inside])
+
+    keys = np.sort(np.concatenate(cell_ids) * (nx * ny) + np.concatenate(cells))
+    keys = keys[np.diff(keys, prepend=-1) != 0]
+    return keys // (nx * ny), keys % (nx * ny)
+
+
 class Obstacle:
     def __init__(self, edges, color):
         self.edges = edges
@@ -35,58 +88,158 @@ class Obstacle:
 
 
 class Wallmap:
-    def __init__(self, grid_size=16, *, width=800, height=600):
+    def __init__(self, grid_size=16, *, width=800, height=600, index_backend='grid'):
         self.grid_size = grid_size
-        self.tilemap = {}
-        self.gridmap = {}
         self.edges = []
         self.obstacles = []
         self.width = width
         self.height = height
 
+        self.nx = width // grid_size
+        self.ny = height // grid_size
+
+        # chunks of edge coordinates in grid units and of (edge ids, cell ids) pairs,
+        # gathered into the index on demand
+        self.edge_segments = []
+        self.edge_cells = []
+
+        # compact tile index: the edge ids of cell c are cell_edges[cell_offsets[c]:cell_offsets[c+1]]
+        # and edge_table holds x1, y1, x2, y2 of every edge already scaled by grid_size
+        self.edge_table = np.empty((0, 4))
+        self.cell_offsets = np.zeros(self.nx * self.ny + 1, dtype=np.intp)
+        self.cell_edges = np.empty(0, dtype=np.intp)
+        self.index_dirty = False
+
+        # spatial index answering segment and circle queries, see spatial_index.SPATIAL_INDEXES
+        self.index_backend = index_backend
+        self.spatial_index = None
+
+        # static layers rendered once and blitted every frame, dropped whenever the map changes
+        self.layers = {}
+
+        # on-disk cache of the arrays derived from the walls, set by map_file.load_map
+        self.cache = None
+
     def get_obstacles(self):
         return self.obstacles
 
+    def get_segments(self):
+        # wall segments as an (E, 4) array of x1, y1, x2, y2 in pixels
+        self.build_index()
+        return self.edge_table
+
+    def get_index(self):
+        self.build_index()
+        return self.cell_offsets, self.cell_edges
+
+    def get_spatial_index(self):
+        if self.spatial_index is None:
+            self.build_index()
+            self.spatial_index = spatial_index.create_spatial_index(self, self.index_backend)
+        return self.spatial_index
+
+    def build_index(self):
+        if not self.index_dirty:
+            return
+
+        self.edge_segments = [np.concatenate(self.edge_segments or [np.empty((0, 4))])]
+        self.edge_table = self.edge_segments[0] * self.grid_size
+
+        edge_ids = np.concatenate([ids for ids, _ in self.edge_cells] or [np.empty(0, dtype=np.intp)])
+        cells = np.concatenate([cells for _, cells in self.edge_cells] or [np.empty(0, dtype=np.intp)])
+        self.edge_cells = [(edge_ids, cells)]
+
+        order = np.argsort(cells, kind='stable')
+        self.cell_edges = edge_ids[order]
+        self.cell_offsets = np.concatenate((
+            [0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))
+        )).astype(np.intp)
+
+        self.index_dirty = False
+
+    def load_index(self, edges, segments, cell_offsets, cell_edges):
+        # adopts a tile index built earlier for these edges, e.g. memory-mapped from a map cache
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        cells = np.repeat(np.arange(self.nx * self.ny), np.diff(cell_offsets))
+
+        self.edges = list(edges)
+        self.edge_segments = [segments]
+        self.edge_cells = [(cell_edges, cells)]
+        self.edge_table = segments * self.grid_size
+        self.cell_offsets = cell_offsets
+        self.cell_edges = cell_edges
+        self.index_dirty = False
+        self.spatial_index = None
+        self.layers = {}
+
+    def cached(self, name, build):
+        # an array derived from the walls, loaded from the map cache or built and saved there;
+        # name has to tell apart every parameter the array depends on
+        if self.cache is None:
+            return build()
+        return self.cache.load_or_build(name, build)
+
+    def cell_position(self, cell):
+        return (cell % self.nx, cell // self.nx)
+
+    def cell_edge_ids(self, cell):
+        self.build_index()
+        return self.cell_edges[self.cell_offsets[cell]:self.cell_offsets[cell + 1]]
+
+    def cells_edge_ids(self, cells):
+        # concatenated edge ids of all the given cells
+        self.build_index()
+        starts = self.cell_offsets[cells]
+        counts = self.cell_offsets[cells + 1] - starts
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return self.cell_edges[np.repeat(starts, counts) + positions]
+
+    def cells_in_box(self, min_x, max_x, min_y, max_y):
+        # non-empty cells inside the inclusive box of cell coordinates, clipped to the grid
+        self.build_index()
+        xs = np.arange(max(min_x, 0), min(max_x, self.nx - 1) + 1)
+        ys = np.arange(max(min_y, 0), min(max_y, self.ny - 1) + 1)
+        cells = (ys[None, :] * self.nx + xs[:, None]).ravel()
+        return cells[self.cell_offsets[cells + 1] > self.cell_offsets[cells]]
+
+    @classmethod
+    def from_segments(cls, segments, grid_size=16, *, width=800, height=600, index_backend='grid'):
+        # segments is an (E, 4) array of x1, y1, x2, y2 in grid units
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        wallmap = cls(grid_size, width=width, height=height, index_backend=index_backend)
+        wallmap.add_edges([Edge(s[:2], s[2:]) for s in segments], segments=segments)
+        return wallmap
+
     def add_edge(self, edge):
-        pos1 = edge.pos1
-        pos2 = edge.pos2
-        loc_str = f'{pos1};{pos2}'
-        self.gridmap[loc_str] = edge
-
-        self.edges.append(edge)
-
-        for x in range(min(pos1[0], pos2[0])-1, max(pos1[0], pos2[0])+1):
-            for y in range(min(pos1[1], pos2[1])-1, max(pos1[1], pos2[1])+1):
-
-                # check if x, y is inside borders
-
-                if x < 0 or x >= self.width // self.grid_size or y < 0 or y >= self.height // self.grid_size:
-                    continue
-
-                tile_points = [(x, y), (x+1, y), (x, y+1), (x+1, y+1)]
-                for i in range(len(tile_points)):
-                    tile_point0 = np.array(tile_points[i])
-                    tile_point1 = np.array(
-                        tile_points[(i+1) % len(tile_points)])
-                    if geometry_utils.line_line_intersection((pos1, pos2), (tile_point0, tile_point1)):
-                        edge_loc_str = f'{x};{y}'
-                        if edge_loc_str in self.tilemap:
-                            self.tilemap[edge_loc_str].append(edge)
-                        else:
-                            self.tilemap[edge_loc_str] = [edge]
-                        break
+        self.add_edges((edge,))
+
+    def add_edges(self, edges, *, segments=None):
+        # segments optionally gives the (E, 4) grid coordinates of edges, skipping their gathering
+        first_id = len(self.edges)
+        self.edges.extend(edges)
+
+        if segments is None:
+            segments = np.array(
+                [(*edge.pos1, *edge.pos2) for edge in self.edges[first_id:]], dtype=np.float64)
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        edge_ids, cells = supercover_cells(segments, self.nx, self.ny)
+
+        self.edge_segments.append(segments)
+        self.edge_cells.append((edge_ids + first_id, cells))
+        self.index_dirty = True
+        self.spatial_index = None
+        self.layers = {}
 
     def add_obstacle(self, obstacle):
         for edge in obstacle.edges:
             edge.add_obstacle(obstacle)
 
         self.obstacles.append(obstacle)
+        self.layers = {}
 
     def draw_walls(self, screen):
-        for edge in self.gridmap.values():
-            draw_pos1 = edge.pos1 * self.grid_size
-            draw_pos2 = edge.pos2 * self.grid_size
-            pygame.draw.line(screen, BLACK, draw_pos1, draw_pos2, 1)
+        for x1, y1, x2, y2 in self.get_segments():
+            pygame.draw.line(screen, BLACK, (x1, y1), (x2, y2), 1)
 
     def draw_obstacles(self, screen):
 
@@ -101,9 +254,11 @@ class Wallmap:
 
     def draw_tile_debug(self, screen):
         # represent tiles in tilemap as red rectangles, with increasing intensity for each edge
-        for tile in self.tilemap:
-            tx, yx = tuple(int(x) for x in tile.split(';'))[:2]
-            intensity = (len(self.edges) - len(self.tilemap[tile])) / len(self.edges)
+        self.build_index()
+        counts = np.diff(self.cell_offsets)
+        for cell in np.flatnonzero(counts):
+            tx, yx = self.cell_position(cell)
+            intensity = (len(self.edges) - counts[cell]) / len(self.edges)
             intensity = intensity ** 4
             pygame.draw.rect(
                 screen,
@@ -114,64 +269,78 @@ class Wallmap:
     def draw_debug(self, screen):
         self.draw_tile_debug(screen)
 
+    def get_layer(self, name):
+        # 'map' holds the walls and obstacles over a transparent background,
+        # 'tiles' the tile debug view over the white background
+        if name not in self.layers:
+            if name == 'map':
+                layer = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+                self.draw_walls(layer)
+                self.draw_obstacles(layer)
+            elif name == 'tiles':
+                layer = pygame.Surface((self.width, self.height))
+                layer.fill(WHITE)
+                self.draw_tile_debug(layer)
+            else:
+                raise ValueError(f'Invalid wallmap layer {name}')
+
+            # blits are faster in the display pixel format, once there is a display
+            if pygame.display.get_surface() is not None:
+                layer = layer.convert_alpha() if name == 'map' else layer.convert()
+            self.layers[name] = layer
+
+        return self.layers[name]
+
     def draw(self, screen):
-        self.draw_walls(screen)
-        self.draw_obstacles(screen)
+        screen.blit(self.get_layer('map'), (0, 0))
 
     def particle_has_collision(self, position, radius):
+        # a single position reads the tile index directly, the spatial index pays off for batches
         grid_pos = [math.floor(position[0] / self.grid_size), math.floor(position[1] / self.grid_size)]
         grid_range = math.ceil(radius / self.grid_size)
 
-        for x_offset in range(-grid_range, grid_range+1):
-            for y_offset in range(-grid_range, grid_range+1):
-                # check if x, y is inside borders
-
-                x = grid_pos[0] + x_offset
-                y = grid_pos[1] + y_offset
+        cells = self.cells_in_box(
+            grid_pos[0] - grid_range, grid_pos[0] + grid_range,
+            grid_pos[1] - grid_range, grid_pos[1] + grid_range
+        )
+        edge_ids = np.unique(self.cells_edge_ids(cells))
 
-                if x < 0 or x >= self.width // self.grid_size or y < 0 or y >= self.height // self.grid_size:
-                    continue
+        if kernels.use_numba():
+            return kernels.circle_collision(self.edge_table[edge_ids], position, radius)
 
-                if f'{x};{y}' in self.tilemap:
-                    edges = self.tilemap[f'{x};{y}']
-                    for edge in edges:
-                        if geometry_utils.circle_line_collision(
-                            edge.pos1 * self.grid_size, edge.pos2 * self.grid_size,
-                            position, radius
-                        ):
-                            return True
+        for edge_id in edge_ids:
+            x1, y1, x2, y2 = self.edge_table[edge_id]
+            if geometry_utils.circle_line_collision((x1, y1), (x2, y2), position, radius):
+                return True
         return False
 
-    def get_surrounding_cells_range(self, pos, range_, angle, aperture=math.pi):
+    def particles_have_collision(self, positions, radius):
+        # batched particle_has_collision, one flag per position
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        query_ids, edge_ids = self.get_spatial_index().query_circles(positions, radius)
 
-        surrounding_cells = []
+        hits = geometry_utils.circle_segments_collision(self.edge_table[edge_ids], positions[query_ids], radius)
+        collision = np.zeros(len(positions), dtype=bool)
+        collision[query_ids[hits]] = True
+        return collision
+
+    def get_surrounding_cells_range(self, pos, range_, angle, aperture=math.pi):
 
         grid_pos = [math.floor(pos[0] / self.grid_size),
                     math.floor(pos[1] / self.grid_size)]
         grid_range = math.ceil(range_ / self.grid_size)
 
-        for x_offset in range(-grid_range, grid_range+1):
-            for y_offset in range(-grid_range, grid_range+1):
-                # check if x, y is inside borders
-
-                x = grid_pos[0] + x_offset
-                y = grid_pos[1] + y_offset
+        cells = self.cells_in_box(
+            grid_pos[0] - grid_range, grid_pos[0] + grid_range,
+            grid_pos[1] - grid_range, grid_pos[1] + grid_range
+        )
 
-                if x < 0 or x >= self.width // self.grid_size or y < 0 or y >= self.height // self.grid_size:
-                    continue
-
-                if f'{x};{y}' in self.tilemap:
-                    surrounding_cells.append((
-                        f'{x};{y}', self.tilemap[f'{x};{y}']))
-
-        return surrounding_cells
+        return [(cell, self.cell_edge_ids(cell)) for cell in cells]
 
     def get_surrounding_cells_aperture(self, pos, range_, angle, aperture=math.pi):
 
         def sign_0(a): return 1 if a > 0 else -1 if a < 0 else 0
 
-        surrounding_cells = []
-
         grid_pos = [math.floor(pos[0] / self.grid_size),
                     math.floor(pos[1] / self.grid_size)]
         grid_range = math.ceil(range_ / self.grid_size)
@@ -216,21 +385,12 @@ class Wallmap:
         min_y = min((min(y_aperture_min), min(y_aperture_max), min(y_range)))
         max_y = max((max(y_aperture_min), max(y_aperture_max), max(y_range)))
 
-        for x_offset in range(min_x, max_x+1):
-            for y_offset in range(min_y, max_y+1):
-                # check if x, y is inside borders
-
-                x = grid_pos[0] + x_offset
-                y = grid_pos[1] + y_offset
-
-                if x < 0 or x >= self.width // self.grid_size or y < 0 or y >= self.height // self.grid_size:
-                    continue
-
-                if f'{x};{y}' in self.tilemap:
-                    surrounding_cells.append((
-                        f'{x};{y}', self.tilemap[f'{x};{y}']))
+        cells = self.cells_in_box(
+            grid_pos[0] + min_x, grid_pos[0] + max_x,
+            grid_pos[1] + min_y, grid_pos[1] + max_y
+        )
 
-        return surrounding_cells
+        return [(cell, self.cell_edge_ids(cell)) for cell in cells]
 
     def get_surrounding_cells(self, pos, *, mode='aperture', **kwargs):
         if mode == 'aperture':
@@ -0,0 +1,145 @@
+import math
+
+import numpy as np
+import pytest
+
+import game_environment
+import raycast
+
+RANGE = 450
+APERTURE = 2.0
+NUM_SENSORS = 8
+
+
+def random_poses(wallmap, count, margin=100, seed=0):
+    # origins both inside and around the map, where walls can lie outside the grid
+    rng = np.random.default_rng(seed)
+    xs = rng.uniform(-margin, wallmap.width + margin, count)
+    ys = rng.uniform(-margin, wallmap.height + margin, count)
+    angles = rng.uniform(0, 2 * np.pi, count)
+    return xs, ys, angles
+
+
+def brute_force(wallmap, xs, ys, angles):
+    return raycast.cast_rays(
+        xs, ys, angles, wallmap.get_segments(), range_=RANGE, aperture=APERTURE, num_sensors=NUM_SENSORS)
+
+
+def baseline_range(segments, x, y, beam):
+    # the per-wall shapely intersection the particles were measured with before cast_rays
+    import geometry_utils
+
+    sample = (x + RANGE * math.cos(beam), y + RANGE * math.sin(beam))
+    distances = [RANGE]
+    for x1, y1, x2, y2 in segments:
+        point = geometry_utils.line_line_intersection(((x1, y1), (x2, y2)), ((x, y), sample))
+        if point is not None:
+            distances.append(math.dist((x, y), point))
+    return min(distances)
+
+
+@pytest.mark.parametrize('env_id', ['environment_1', 'environment_2'])
+def test_cast_rays_matches_baseline(env_id):
+    wallmap = game_environment.Environment(env_id).wallmap
+    xs, ys, angles = random_poses(wallmap, 40)
+    beams = raycast.sensor_angles(angles, APERTURE, NUM_SENSORS)
+
+    segments = wallmap.get_segments()
+    expected = [[baseline_range(segments, x, y, beam) for beam in row] for x, y, row in zip(xs, ys, beams)]
+    np.testing.assert_allclose(brute_force(wallmap, xs, ys, angles), expected, atol=1e-6)
+
+
+def test_range_table_is_exact_at_cell_centers():
+    from range_table import RangeTable
+
+    wallmap = game_environment.Environment('environment_2').wallmap
+    table = RangeTable(wallmap, range_=RANGE, resolution=10, num_headings=72, dtype=np.float64)
+
+    # cell centers and headings on the table grid, where the lookup needs no approximation
+    rng = np.random.default_rng(0)
+    xs = (rng.integers(0, table.nx, 500) + 0.5) * table.resolution
+    ys = (rng.integers(0, table.ny, 500) + 0.5) * table.resolution
+    angles = rng.integers(0, table.num_headings, 500) * table.heading_step
+
+    ranges = table.cast_rays(xs, ys, angles, range_=RANGE, aperture=0.0, num_sensors=1)
+    expected = raycast.cast_rays(xs, ys, angles, wallmap.get_segments(), range_=RANGE, aperture=0.0, num_sensors=1)
+    np.testing.assert_allclose(ranges, expected, atol=1e-9)
+
+
+@pytest.mark.parametrize('env_id', ['environment_1', 'environment_2'])
+def test_grid_marcher_matches_brute_force(env_id):
+    wallmap = game_environment.Environment(env_id).wallmap
+    xs, ys, angles = random_poses(wallmap, 2000)
+
+    ranges = raycast.GridMarcher(wallmap).cast_rays(
+        xs, ys, angles, range_=RANGE, aperture=APERTURE, num_sensors=NUM_SENSORS)
+    np.testing.assert_allclose(ranges, brute_force(wallmap, xs, ys, angles), atol=1e-9)
+
+
+@pytest.mark.parametrize('backend', ['grid', 'strtree'])
+def test_collisions_match_baseline(backend):
+    import geometry_utils
+
+    wallmap = game_environment.Environment('environment_1', index_backend=backend).wallmap
+    rng = np.random.default_rng(0)
+    positions = np.column_stack((rng.uniform(0, wallmap.width, 2000), rng.uniform(0, wallmap.height, 2000)))
+    radius = 5
+
+    # the baseline test of every wall, one circle at a time
+    expected = np.array([
+        any(geometry_utils.circle_line_collision((x1, y1), (x2, y2), position, radius)
+            for x1, y1, x2, y2 in wallmap.get_segments())
+        for position in positions
+    ])
+
+    single = np.array([wallmap.particle_has_collision(position, radius) for position in positions])
+    np.testing.assert_array_equal(single, expected)
+    np.testing.assert_array_equal(wallmap.particles_have_collision(positions, radius), expected)
+
+
+@pytest.mark.parametrize('env_id', ['environment_1', 'environment_2'])
+@pytest.mark.parametrize('backend', ['grid', 'strtree'])
+def test_index_caster_matches_brute_force(env_id, backend):
+    wallmap = game_environment.Environment(env_id, index_backend=backend).wallmap
+    xs, ys, angles = random_poses(wallmap, 2000)
+
+    ranges = raycast.IndexCaster(wallmap).cast_rays(
+        xs, ys, angles, range_=RANGE, aperture=APERTURE, num_sensors=NUM_SENSORS)
+    np.testing.assert_allclose(ranges, brute_force(wallmap, xs, ys, angles), atol=1e-9)
+
+
+@pytest.mark.parametrize('ray_caster', ['brute', 'dda'])
+def test_parallel_caster_matches_brute_force(ray_caster):
+    from parallel import ParallelCaster
+
+    wallmap = game_environment.Environment('environment_1').wallmap
+    xs, ys, angles = random_poses(wallmap, 1000, margin=0)
+
+    caster = ParallelCaster(wallmap, workers=2, threshold=0, ray_caster=ray_caster)
+    try:
+        ranges = caster.cast_rays(xs, ys, angles, range_=RANGE, aperture=APERTURE, num_sensors=NUM_SENSORS)
+    finally:
+        caster.close()
+    np.testing.assert_allclose(ranges, brute_force(wallmap, xs, ys, angles), atol=1e-9)
+
+
+def test_numba_backend_matches_numpy():
+    pytest.importorskip('numba')
+    import kernels
+
+    wallmap = game_environment.Environment('environment_1').wallmap
+    xs, ys, angles = random_poses(wallmap, 500)
+
+    def run():
+        ranges = brute_force(wallmap, xs, ys, angles)
+        collisions = [wallmap.particle_has_collision((x, y), 5) for x, y in zip(xs, ys)]
+        return ranges, collisions
+
+    expected_ranges, expected_collisions = run()
+    kernels.set_backend('numba')
+    try:
+        ranges, collisions = run()
+    finally:
+        kernels.set_backend('numpy')
+    np.testing.assert_allclose(ranges, expected_ranges, atol=1e-9)
+    assert collisions == expected_collisions
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from density_store import DensityReader, DensityStore
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_density_store_round_trip(tmp_path, compress):
+    rng = np.random.default_rng(0)
+    snapshots = rng.uniform(size=(7, 12, 16)).astype(np.float32)
+    snapshots /= snapshots.sum(axis=(1, 2), keepdims=True)
+
+    store = DensityStore(tmp_path, dtype='float32', chunk_size=3, compress=compress)
+    for index, snapshot in enumerate(snapshots):
+        store.append(snapshot, index * 10)
+    store.close()
+
+    reader = DensityReader(tmp_path)
+    assert len(reader) == len(snapshots)
+    for (index, density_map), (expected_index, snapshot) in zip(reader, enumerate(snapshots)):
+        assert index == expected_index * 10
+        np.testing.assert_allclose(density_map, snapshot, rtol=1e-5)
@@ -0,0 +1,70 @@
+import numpy as np
+
+import filter_bank
+import game_environment
+import raycast
+from filter_bank import FilterBank
+from range_table import RangeTable
+
+SENSORS = {'range_': 300, 'aperture': 2.0, 'num_sensors': 6}
+
+
+def create_bank(wallmap, num_filters=3, num_particles=200, **kwargs):
+    return FilterBank(wallmap, num_filters, num_particles, start_position=(200, 300), **SENSORS, **kwargs)
+
+
+def test_shapes_hold_across_resamples():
+    np.random.seed(0)
+    wallmap = game_environment.Environment('environment_1').wallmap
+    bank = create_bank(wallmap, gen_interval=1, resampler='systematic')
+
+    for step in range(6):
+        robot_measurements = bank.step(3, 5 if step % 2 else 0)
+        assert robot_measurements.shape == (3, SENSORS['num_sensors'])
+        for array in (bank.xs, bank.ys, bank.angles):
+            assert array.shape == (3, 200)
+        assert bank.measurements.shape == (3, 200, SENSORS['num_sensors'])
+        assert ((bank.xs >= 0) & (bank.xs < wallmap.width)).all()
+
+    position_errors, heading_errors = bank.localization_errors()
+    assert position_errors.shape == heading_errors.shape == (3,)
+
+
+def test_filter_without_positive_scores_keeps_its_particles(monkeypatch):
+    np.random.seed(0)
+    wallmap = game_environment.Environment('environment_1').wallmap
+    bank = create_bank(wallmap)
+    bank.measure(particles=True)
+
+    scores = bank.likelihood()
+    scores[1] = np.where(np.arange(200) % 2, 0.0, -0.5)
+    monkeypatch.setattr(bank, 'likelihood', lambda: scores)
+
+    xs, ys, angles = bank.xs.copy(), bank.ys.copy(), bank.angles.copy()
+    bank.generate_particles()
+
+    np.testing.assert_array_equal(bank.xs[1], xs[1])
+    np.testing.assert_array_equal(bank.ys[1], ys[1])
+    np.testing.assert_array_equal(bank.angles[1], angles[1])
+    assert not np.array_equal(bank.xs[0], xs[0])
+
+
+def test_robots_are_measured_exactly(monkeypatch):
+    monkeypatch.setattr(filter_bank, 'SIGMA_MEASURE', 0.0)
+    np.random.seed(0)
+    wallmap = game_environment.Environment('environment_1').wallmap
+    table = RangeTable(wallmap, range_=SENSORS['range_'], resolution=20, num_headings=36)
+    bank = create_bank(wallmap, caster=table)
+
+    # robot poses away from the table grid, where the lookup is only approximate
+    bank.robot_xs = np.array([203.7, 411.3, 617.9])
+    bank.robot_ys = np.array([301.1, 287.4, 150.6])
+    bank.robot_angles = np.array([0.13, 1.71, 4.02])
+    robot_measurements = bank.measure(particles=True)
+
+    exact = raycast.cast_rays(bank.robot_xs, bank.robot_ys, bank.robot_angles, wallmap.get_segments(), **SENSORS)
+    np.testing.assert_allclose(robot_measurements, exact)
+    assert not np.allclose(table.cast_rays(bank.robot_xs, bank.robot_ys, bank.robot_angles, **SENSORS), exact)
+
+    particle_ranges = table.cast_rays(bank.xs.ravel(), bank.ys.ravel(), bank.angles.ravel(), **SENSORS)
+    np.testing.assert_allclose(bank.measurements, particle_ranges.reshape(bank.measurements.shape))
@@ -0,0 +1,67 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import main
+from filter_thread import FilterThread
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'config.ini')
+
+
+@pytest.fixture
+def game(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('stats')
+    np.random.seed(0)
+    return main.Game(main.read_config(CONFIG_PATH, 'SimSettings1'), headless=True)
+
+
+def test_reads_are_consistent_while_the_worker_publishes(game):
+    filter_thread = FilterThread(game)
+    filter_thread.set_controls(3, 5)
+    filter_thread.start()
+
+    steps = []
+    try:
+        deadline = time.perf_counter() + 30
+        while len(set(steps)) < 5 and time.perf_counter() < deadline:
+            with filter_thread.poses.read() as poses:
+                step, count = poses.step, poses.count
+                xs = poses.xs.copy()
+                # the worker keeps stepping, but never writes the buffer being read
+                time.sleep(0.01)
+                assert (poses.step, poses.count) == (step, count)
+                assert len(poses.xs) == len(poses.ys) == len(poses.angles) == count
+                np.testing.assert_array_equal(poses.xs, xs)
+            steps.append(step)
+    finally:
+        filter_thread.stop()
+
+    assert len(set(steps)) >= 5
+    assert steps == sorted(steps)
+    with filter_thread.poses.read() as poses:
+        assert poses.step == game.frame_count
+        np.testing.assert_array_equal(poses.xs, game.particles.xs)
+
+
+def test_stop_raises_the_error_of_the_worker(game, monkeypatch):
+    step = game.step
+    calls = []
+
+    def failing_step(speed, rotation):
+        calls.append(speed)
+        if len(calls) == 3:
+            raise RuntimeError('step failed')
+        step(speed, rotation)
+
+    monkeypatch.setattr(game, 'step', failing_step)
+    filter_thread = FilterThread(game)
+    filter_thread.start()
+    filter_thread.thread.join(30)
+
+    assert not filter_thread.thread.is_alive()
+    with pytest.raises(RuntimeError, match='step failed'):
+        filter_thread.stop()
+    assert len(calls) == 3
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pytest
+
+import game_environment
+import map_file
+
+
+@pytest.mark.parametrize('env_id', ['environment_1', 'environment_2'])
+def test_map_cache_round_trip(tmp_path, env_id):
+    path = os.path.join(game_environment.MAPS_DIRECTORY, f'{env_id}.json')
+    uncached = map_file.load_map(path)
+    built = map_file.load_map(path, cache_directory=tmp_path)
+    cached = map_file.load_map(path, cache_directory=tmp_path)
+
+    offsets, cell_edges = cached.get_index()
+    assert isinstance(offsets, np.memmap) and isinstance(cell_edges, np.memmap)
+    for wallmap in (built, cached):
+        np.testing.assert_array_equal(wallmap.get_segments(), uncached.get_segments())
+        for array, expected in zip(wallmap.get_index(), uncached.get_index()):
+            np.testing.assert_array_equal(array, expected)
+    assert len(cached.obstacles) == len(uncached.obstacles)
+
+    distances = cached.cached('test_array', lambda: np.arange(5.0))
+    assert isinstance(distances, np.memmap)
+    np.testing.assert_array_equal(cached.cached('test_array', lambda: np.zeros(5)), np.arange(5.0))
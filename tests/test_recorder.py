@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import pygame
+import pytest
+
+from recorder import FrameRecorder, read_frames
+
+
+def surfaces(count, size=(20, 12)):
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (count, size[0], size[1], 3), dtype=np.uint8)
+    return frames, [pygame.surfarray.make_surface(frame) for frame in frames]
+
+
+@pytest.mark.parametrize('format', ['raw', 'zlib'])
+def test_frame_container_round_trip(tmp_path, format):
+    frames, frame_surfaces = surfaces(5)
+    recorder = FrameRecorder(tmp_path, (20, 12), format=format, pool_size=2)
+    for frame_index, surface in enumerate(frame_surfaces):
+        recorder.capture(surface, frame_index)
+    recorder.close()
+
+    read = list(read_frames(tmp_path / 'frames.mcl'))
+    assert [frame_index for frame_index, _ in read] == list(range(5))
+    for (_, frame), expected in zip(read, frames):
+        np.testing.assert_array_equal(frame, expected.transpose(1, 0, 2))
+
+
+def test_frame_png_round_trip(tmp_path):
+    frames, frame_surfaces = surfaces(3)
+    recorder = FrameRecorder(tmp_path, (20, 12), format='png')
+    for frame_index, surface in enumerate(frame_surfaces):
+        recorder.capture(surface, frame_index)
+    recorder.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['00000000.png', '00000001.png', '00000002.png']
+    for frame_index, expected in enumerate(frames):
+        image = pygame.image.load(str(tmp_path / f'{str(frame_index).zfill(8)}.png'))
+        np.testing.assert_array_equal(pygame.surfarray.array3d(image), expected)
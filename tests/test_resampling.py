@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+import resampling
+
+
+@pytest.mark.parametrize('name', sorted(resampling.RESAMPLERS))
+@pytest.mark.parametrize('shape', [(200,), (5, 200)])
+def test_resampler_shapes(name, shape):
+    np.random.seed(0)
+    weights = np.random.uniform(size=shape)
+    indices = resampling.get_resampler(name)(weights, 300)
+
+    assert indices.shape == shape[:-1] + (300,)
+    assert indices.min() >= 0 and indices.max() < shape[-1]
+
+
+@pytest.mark.parametrize('name', sorted(resampling.RESAMPLERS))
+def test_resampler_is_unbiased(name):
+    np.random.seed(0)
+    weights = np.array([0.5, 0.25, 0.125, 0.125, 0.0])
+    indices = resampling.get_resampler(name)(np.tile(weights, (400, 1)), 100)
+
+    frequencies = np.bincount(indices.ravel(), minlength=len(weights)) / indices.size
+    np.testing.assert_allclose(frequencies, weights, atol=0.01)
+    assert frequencies[-1] == 0
+
+
+def test_resampler_rows_are_independent():
+    np.random.seed(0)
+    weights = np.zeros((3, 10))
+    weights[np.arange(3), [2, 5, 7]] = 1.0
+
+    for name in resampling.RESAMPLERS:
+        indices = resampling.get_resampler(name)(weights, 20)
+        assert (indices == np.array([[2], [5], [7]])).all()
+
+
+def test_residual_keeps_the_expected_copies():
+    np.random.seed(0)
+    weights = np.array([[0.42, 0.31, 0.27], [0.05, 0.05, 0.9]])
+    indices = resampling.residual_resampling(weights, 10)
+
+    for row, row_weights in zip(indices, weights):
+        counts = np.bincount(row, minlength=3)
+        assert (counts >= np.floor(row_weights * 10)).all()
+        assert counts.sum() == 10
+
+
+def test_invalid_resampler():
+    with pytest.raises(ValueError):
+        resampling.get_resampler('invalid')
+
+
+def test_kld_bound():
+    bounds = resampling.kld_bound(np.arange(1, 200), 0.05, 2.33)
+
+    assert bounds[0] == 1
+    assert (np.diff(bounds) > 0).all()
+    # k = 1: 1 / (2 epsilon) * (1 - 2/9 + sqrt(2/9) z)^3
+    assert bounds[1] == np.ceil(10 * (1 - 2 / 9 + np.sqrt(2 / 9) * 2.33) ** 3)
+    assert (resampling.kld_bound(100, 0.01, 2.33) > resampling.kld_bound(100, 0.05, 2.33)).all()
+
+
+def test_kld_sampler_limits():
+    rng = np.random.default_rng(0)
+
+    def draw_point(n):
+        return np.zeros((n, 2)), np.zeros(n)
+
+    def draw_spread(n):
+        return rng.uniform(0, 10000, (n, 2)), rng.uniform(0, 2 * np.pi, n)
+
+    positions, angles = resampling.KLDSampler(min_particles=50).sample(draw_point)
+    assert len(positions) == len(angles) == 50
+
+    positions, _ = resampling.KLDSampler(max_particles=3000).sample(draw_spread)
+    assert len(positions) == 3000
+
+    kept_positions, kept_angles = draw_spread(1000)
+    positions, _ = resampling.KLDSampler(max_particles=3000).sample(draw_spread, kept_positions, kept_angles)
+    assert len(positions) == 2000
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import main
+import sweep
+from trajectory import load_trajectory
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'config.ini')
+
+
+@pytest.fixture
+def settings():
+    return {
+        'config_data': main.read_config(CONFIG_PATH, 'SimSettings1'),
+        'commands': load_trajectory(),
+        'steps': 3,
+        'converged_error': 20.0,
+        'timeout': 120.0,
+    }
+
+
+def test_parse_grid():
+    assert sweep.parse_grid(['num_sensors=8,20', 'samples=100']) == {'num_sensors': ['8', '20'], 'samples': ['100']}
+    with pytest.raises(ValueError):
+        sweep.parse_grid(['unknown=1'])
+    with pytest.raises(ValueError):
+        sweep.parse_grid(['num_sensors='])
+
+
+def test_run_ids_depend_on_base_settings(settings):
+    grid = {'num_sensors': ['8', '20'], 'samples': ['100']}
+    runs = sweep.expand_runs(grid, 2, 0, sweep.settings_key(settings, 'SimSettings1'))
+
+    assert len(runs) == 4
+    assert len({run_id for run_id, _, _ in runs}) == 4
+    assert runs == sweep.expand_runs(grid, 2, 0, sweep.settings_key(settings, 'SimSettings1'))
+
+    for changed in ({'steps': 4}, {'converged_error': 10.0}, {'commands': settings['commands'][1:]}):
+        other = sweep.expand_runs(grid, 2, 0, sweep.settings_key({**settings, **changed}, 'SimSettings1'))
+        assert not {run_id for run_id, _, _ in runs} & {run_id for run_id, _, _ in other}
+
+
+def test_sweep_resumes(tmp_path, monkeypatch, settings):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('stats')
+
+    grid = {'num_sensors': ['8']}
+    names = sorted(grid)
+    fieldnames = list(sweep.RESULT_FIELDS[:2]) + names + list(sweep.RESULT_FIELDS[2:])
+    key = sweep.settings_key(settings, 'SimSettings1')
+    output = str(tmp_path / 'sweep.csv')
+
+    sweep.run_sweep(sweep.expand_runs(grid, 1, 0, key), settings, output, fieldnames, workers=1)
+    rows = sweep.read_results(output)
+    assert [row['status'] for row in rows] == ['ok']
+
+    # one more seed: only the new run is added
+    runs = sweep.expand_runs(grid, 2, 0, key)
+    sweep.run_sweep(runs, settings, output, fieldnames, workers=1)
+    rows = sweep.read_results(output)
+    assert sorted(row['run_id'] for row in rows) == sorted(run_id for run_id, _, _ in runs)
+
+    summary = sweep.summarize(rows, names)
+    assert len(summary) == 1 and summary[0]['runs'] == 2 and summary[0]['failed'] == 0
+
+
+def test_sweep_retries_failed_runs(tmp_path, monkeypatch, settings):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('stats')
+
+    grid = {'num_sensors': ['8']}
+    names = sorted(grid)
+    fieldnames = list(sweep.RESULT_FIELDS[:2]) + names + list(sweep.RESULT_FIELDS[2:])
+    runs = sweep.expand_runs(grid, 1, 0, sweep.settings_key(settings, 'SimSettings1'))
+    output = str(tmp_path / 'sweep.csv')
+
+    sweep.run_sweep(runs, {**settings, 'timeout': 1e-6}, output, fieldnames, workers=1)
+    assert [row['status'] for row in sweep.read_results(output)] == ['timeout']
+
+    sweep.run_sweep(runs, settings, output, fieldnames, workers=1)
+    rows = sweep.read_results(output)
+    assert [row['status'] for row in rows] == ['timeout', 'ok']
+    assert [row['status'] for row in sweep.latest_results(rows)] == ['ok']
+
+    sweep.run_sweep(runs, settings, output, fieldnames, workers=1)
+    assert len(sweep.read_results(output)) == 2
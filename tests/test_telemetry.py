@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from telemetry import Telemetry, export_csv, read_telemetry
+
+COLUMNS = {'step': 'int64', 'error': 'float64', 'particles': 'int32'}
+
+
+def test_telemetry_file_round_trip(tmp_path):
+    path = tmp_path / 'run.mclt'
+    telemetry = Telemetry(COLUMNS, path, capacity=4)
+    for step in range(10):
+        telemetry.record(step=step, error=step / 2, **({'particles': 100 + step} if step % 3 else {}))
+    telemetry.close()
+
+    columns = read_telemetry(path)
+    assert list(columns) == list(COLUMNS)
+    np.testing.assert_array_equal(columns['step'], np.arange(10))
+    np.testing.assert_array_equal(columns['error'], np.arange(10) / 2)
+    np.testing.assert_array_equal(columns['particles'], [100 + step if step % 3 else -1 for step in range(10)])
+
+    export_csv(path, tmp_path / 'run.csv')
+    lines = (tmp_path / 'run.csv').read_text().splitlines()
+    assert lines[0] == 'step,error,particles'
+    assert lines[2] == '1,0.5,101'
+
+
+def test_telemetry_ring_keeps_latest_rows():
+    telemetry = Telemetry(COLUMNS, capacity=4)
+    for step in range(10):
+        telemetry.record(step=step)
+
+    assert len(telemetry) == 10
+    np.testing.assert_array_equal(telemetry.rows()['step'], [6, 7, 8, 9])
+    assert np.isnan(telemetry.rows()['error']).all()
+
+
+def test_invalid_telemetry_file(tmp_path):
+    path = tmp_path / 'invalid.mclt'
+    path.write_bytes(b'\0' * 16)
+    with pytest.raises(ValueError):
+        read_telemetry(path)
@@ -0,0 +1,20 @@
+import pytest
+
+from trajectory import parse_trajectory
+
+
+def test_parse_trajectory():
+    commands = parse_trajectory("""
+        # comment
+        move 3 2
+        rotate -5
+        step 2 4.5 2  # trailing comment
+        wait
+    """)
+    assert commands == [(3.0, 0.0), (3.0, 0.0), (0.0, -5.0), (2.0, 4.5), (2.0, 4.5), (0.0, 0.0)]
+
+
+@pytest.mark.parametrize('line', ['jump 3', 'move', 'move 1 2 3', 'wait 1 2'])
+def test_invalid_trajectory(line):
+    with pytest.raises(ValueError, match='line 2'):
+        parse_trajectory(f'move 1\n{line}')